@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+"""
+Compares album_match against the original pairwise difflib implementation.
+
+Builds a synthetic corpus of candidate folders for a set of albums, checks that both
+implementations accept and reject exactly the same folders and prints the timings for
+accepted and rejected folders separately. Rejections are where most of the speedup is.
+Pass --backend rapidfuzz to time the compiled backend instead.
+
+    python benchmarks/bench_album_match.py --albums 5 --folders 30 --tracks 20
+"""
+
+import argparse
+import difflib
+import logging
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import soularr  # noqa: E402
+from corpus import build_corpus, install  # noqa: E402
+
+
+def reference_album_match(lidarr_tracks, slskd_tracks, album_name, filetype, minimum_match_ratio):
+    """The matcher as it was before the optimization. Only returns the decision."""
+
+    def check_ratio(separator, ratio, lidarr_filename, slskd_filename):
+        if ratio < minimum_match_ratio:
+            if separator != "":
+                lidarr_filename_word_count = len(lidarr_filename.split()) * -1
+                truncated_slskd_filename = " ".join(slskd_filename.split(separator)[lidarr_filename_word_count:])
+                ratio = difflib.SequenceMatcher(None, lidarr_filename, truncated_slskd_filename).ratio()
+            else:
+                ratio = difflib.SequenceMatcher(None, lidarr_filename, slskd_filename).ratio()
+        return ratio
+
+    counted = 0
+    for lidarr_track in lidarr_tracks:
+        lidarr_filename = lidarr_track["title"] + "." + filetype.split(" ")[0]
+        best_match = 0.0
+        for slskd_track in slskd_tracks:
+            slskd_filename = slskd_track["filename"]
+            ratio = difflib.SequenceMatcher(None, lidarr_filename, slskd_filename).ratio()
+            ratio = check_ratio(" ", ratio, lidarr_filename, slskd_filename)
+            ratio = check_ratio("_", ratio, lidarr_filename, slskd_filename)
+            ratio = check_ratio("", ratio, album_name + " " + lidarr_filename, slskd_filename)
+            ratio = check_ratio(" ", ratio, album_name + " " + lidarr_filename, slskd_filename)
+            ratio = check_ratio("_", ratio, album_name + " " + lidarr_filename, slskd_filename)
+            if ratio > best_match:
+                best_match = ratio
+        if best_match > minimum_match_ratio:
+            counted += 1
+    return counted == len(lidarr_tracks)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="album_match benchmark")
+    parser.add_argument("--albums", type=int, default=5)
+    parser.add_argument("--folders", type=int, default=30)
+    parser.add_argument("--tracks", type=int, default=20)
+    parser.add_argument("--ratio", type=float, default=0.8, help="minimum_filename_match_ratio")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--backend", default="difflib", help="match_backend to benchmark (difflib or rapidfuzz)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    corpus = build_corpus(random.Random(args.seed), args.albums, args.folders, args.tracks)
+    install(corpus, args.backend, args.ratio)
+
+    # Every folder is timed on its own so accepted and rejected folders can be reported apart.
+    # Rejections are mostly cut short by difflib's quick upper bounds, accepts need the full ratio
+    folders = [[[soularr.SlskdFile(file["filename"]) for file in files] for files in candidates] for _, _, candidates in corpus]
+    expected, actual = [], []
+    reference_times, optimized_times = [], []
+    for (name, tracks, candidates), album_folders in zip(corpus, folders):
+        for files, slskd_files in zip(candidates, album_folders):
+            start = time.perf_counter()
+            expected.append(reference_album_match(tracks, files, name, "flac", args.ratio))
+            reference_times.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            actual.append(soularr.album_match(tracks, slskd_files, "user", "flac"))
+            optimized_times.append(time.perf_counter() - start)
+
+    mismatches = sum(1 for a, b in zip(expected, actual) if a != b)
+    print(f"Folders checked: {len(expected)} ({sum(expected)} accepted)")
+    print(f"{'':<10} {'reference':>10} {'album_match (' + soularr.match_backend.name + ')':>24} {'speedup':>8}")
+    for label, accepted in (("accepted", True), ("rejected", False), ("all", None)):
+        picked = [i for i, decision in enumerate(expected) if accepted is None or decision == accepted]
+        if not picked:
+            continue
+        reference_time = sum(reference_times[i] for i in picked)
+        optimized_time = sum(optimized_times[i] for i in picked)
+        print(f"{label:<10} {reference_time:>9.3f}s {optimized_time:>23.3f}s {reference_time / optimized_time:>7.1f}x")
+    print(f"Mismatched decisions: {mismatches}")
+    # Only difflib promises identical decisions. Other backends score slightly differently
+    sys.exit(1 if mismatches and soularr.match_backend.name == "difflib" else 0)
+
+
+if __name__ == "__main__":
+    main()
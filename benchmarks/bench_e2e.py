@@ -0,0 +1,161 @@
+"""
+End-to-end benchmark: runs one full Soularr cycle against local fake slskd and Lidarr servers.
+
+    python benchmarks/bench_e2e.py --albums 20 --peers 8 --latency 0.02
+    python benchmarks/bench_e2e.py --set "Download Settings.pipeline_downloads=True"
+
+Soularr's own fixed waits (the 5s monitor tick, the pause after enqueueing, ...) are multiplied
+by --sleep-scale so a run takes seconds instead of minutes. The fake services keep real time.
+Reports throughput, time per phase and the number of API calls per endpoint.
+"""
+
+import argparse
+import configparser
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import soularr  # noqa: E402
+from fake_services import FakeLidarr, FakeSlskd, Library  # noqa: E402
+
+REPO_CONFIG = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "config.ini")
+
+PHASES = ["get_records", "search_and_queue", "monitor_downloads", "process_completed_album"]
+
+
+def timed(phase_times, name, function):
+    """
+    Wraps a soularr function so the time spent in it is added to phase_times[name].
+    process_completed_album runs on import workers, so its total can exceed the wall time.
+    """
+    lock = threading.Lock()
+
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            with lock:
+                phase_times[name] += time.perf_counter() - start
+
+    return wrapper
+
+
+def write_config(path, slskd_url, lidarr_url, download_dir, albums, overrides):
+    config = configparser.RawConfigParser()
+    config.read(REPO_CONFIG)
+    config["Lidarr"].update({"api_key": "bench", "host_url": lidarr_url, "download_dir": download_dir})
+    config["Slskd"].update({"api_key": "bench", "host_url": slskd_url, "download_dir": download_dir, "url_base": "/"})
+    config["Search Settings"].update(
+        {
+            "search_type": "first_page",
+            "number_of_albums_to_grab": str(albums),
+            "ignored_users": "",
+            "title_blacklist": "",
+            "search_blacklist": "",
+            # The fake slskd has no rate limit to protect
+            "minimum_search_interval": "0",
+        }
+    )
+    config["Logging"]["log_to_file"] = "False"
+    for override in overrides:
+        key, _, value = override.partition("=")
+        section, _, option = key.partition(".")
+        config[section][option] = value
+    with open(path, "w") as file:
+        config.write(file)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Soularr end-to-end benchmark against fake slskd and Lidarr servers")
+    parser.add_argument("--albums", type=int, default=20, help="wanted albums in Lidarr")
+    parser.add_argument("--tracks", type=int, default=10, help="tracks per album")
+    parser.add_argument("--peers", type=int, default=8, help="Soulseek users that answer each search")
+    parser.add_argument("--match-rate", type=float, default=0.4, help="share of those users that have the right folder")
+    parser.add_argument("--latency", type=float, default=0.01, help="seconds added to every API call")
+    parser.add_argument("--search-time", type=float, default=0.5, help="seconds a search takes in slskd")
+    parser.add_argument("--queue-time", type=float, default=0.5, help="seconds a download waits in the remote queue")
+    parser.add_argument("--download-time", type=float, default=1.0, help="seconds a download takes once it starts")
+    parser.add_argument("--import-time", type=float, default=0.2, help="seconds a Lidarr import takes")
+    parser.add_argument("--browse-failure-rate", type=float, default=0.05)
+    parser.add_argument("--transfer-failure-rate", type=float, default=0.02)
+    parser.add_argument("--sleep-scale", type=float, default=0.05, help="multiplier for Soularr's own sleeps")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--set", action="append", default=[], metavar="SECTION.KEY=VALUE", help="override a config.ini setting")
+    parser.add_argument("--log-level", default="CRITICAL", help="Soularr log level. The simulated failures log tracebacks at ERROR")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=args.log_level, format="[%(levelname)s|%(threadName)s] %(message)s")
+    work_dir = tempfile.mkdtemp(prefix="soularr-bench-")
+    download_dir = os.path.join(work_dir, "downloads")
+    os.mkdir(download_dir)
+
+    library = Library(args.albums, args.tracks, args.peers, args.match_rate, args.seed)
+    slskd_service = FakeSlskd(
+        library,
+        download_dir,
+        latency=args.latency,
+        search_time=args.search_time,
+        queue_time=args.queue_time,
+        download_time=args.download_time,
+        browse_failure_rate=args.browse_failure_rate,
+        transfer_failure_rate=args.transfer_failure_rate,
+        seed=args.seed,
+    )
+    lidarr_service = FakeLidarr(library, latency=args.latency, import_time=args.import_time, seed=args.seed)
+    write_config(os.path.join(work_dir, "config.ini"), slskd_service.start(), lidarr_service.start(), download_dir, args.albums, args.set)
+
+    soularr.config_file_path = os.path.join(work_dir, "config.ini")
+    soularr.current_page_file_path = os.path.join(work_dir, ".current_page.txt")
+    soularr.failed_import_denylist_file_path = os.path.join(work_dir, "failed_imports.json")
+    soularr.config = soularr.read_config()
+    soularr.clock = soularr.ScaledClock(1 / args.sleep_scale, scale_time=False)
+    phase_times = defaultdict(float)
+    for name in PHASES:
+        setattr(soularr, name, timed(phase_times, name, getattr(soularr, name)))
+
+    start = time.perf_counter()
+    try:
+        soularr.apply_config(work_dir)
+        ok = soularr.run_cycle()
+    finally:
+        wall_time = time.perf_counter() - start
+        os.chdir(work_dir)
+        slskd_service.stop()
+        lidarr_service.stop()
+
+    imported = len(lidarr_service.imported)
+    results = {
+        "ok": ok,
+        "albums": args.albums,
+        "imported": imported,
+        "wall_seconds": round(wall_time, 2),
+        "albums_per_hour": round(imported / wall_time * 3600, 1) if wall_time else 0.0,
+        "phases": {name: round(phase_times[name], 2) for name in PHASES},
+        "slskd_calls": dict(slskd_service.calls.most_common()),
+        "lidarr_calls": dict(lidarr_service.calls.most_common()),
+    }
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"Imported {imported} of {args.albums} albums in {wall_time:.1f}s ({results['albums_per_hour']} albums/hour)")
+    print("Time per phase (s):")
+    for name, seconds in results["phases"].items():
+        print(f"  {name:<25} {seconds:>8.2f}")
+    for service, calls in (("slskd", results["slskd_calls"]), ("Lidarr", results["lidarr_calls"])):
+        print(f"{service} API calls: {sum(calls.values())}")
+        for endpoint, count in calls.items():
+            print(f"  {count:>6}  {endpoint}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+"""
+Micro-benchmarks for the matching hot path: album_match, match_tracks, FiletypeSpec.matches
+(what verify_filetype used to do), album_track_num and download_filter.
+
+Every function runs over generated folders for a range of track counts. Pass --directory-cache
+to add the folders recorded in a soularr_cache.db. Each benchmark times at least --repeats full
+passes over its calls and reports the ops/sec of the fastest and the median pass, the per-call time
+percentiles and peak memory.
+
+Timings depend on the machine, so no baseline is checked in. Make one yourself from the commit you
+want to compare against, on the machine you will compare on and with the same options (--backend,
+--directory-cache, ...), then run your change against it:
+
+    git stash                       # or check out the base commit
+    python benchmarks/bench_matching.py --save-baseline /tmp/matching-baseline.json
+    git stash pop
+    python benchmarks/bench_matching.py --baseline /tmp/matching-baseline.json --tolerance 10
+
+Only a slowdown of the fastest pass that is larger than --tolerance plus the spread between passes
+seen in both runs counts as a regression, so ordinary noise doesn't fail the comparison. The script
+exits with status 1 when there is one.
+"""
+
+import argparse
+import json
+import logging
+import os
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import soularr  # noqa: E402
+from corpus import build_corpus, install, load_directory_cache  # noqa: E402
+
+ALLOWED_FILETYPES = ["flac 24/192", "flac 16/44.1", "flac", "mp3 320", "mp3"]
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def prepare(corpus):
+    """
+    Turns the corpus into the argument lists each benchmarked function is called with.
+    """
+    album_match_calls = []
+    match_tracks_calls = []
+    directories = []
+    search_files = []
+    for album_name, lidarr_tracks, candidates in corpus:
+        for files in candidates:
+            folder = [soularr.SlskdFile(file["filename"], file.get("size", 0)) for file in files]
+            directory = soularr.SlskdDirectory(album_name, folder)
+            audio = [file for file in folder if file.extension == "flac"]
+            directories.append(directory)
+            if len(audio) == len(lidarr_tracks):
+                album_match_calls.append((lidarr_tracks, audio))
+                # The matcher on its own, without the Lidarr lookup and logging around it
+                match_tracks_calls.append((soularr.lidarr_track_names(lidarr_tracks, album_name, "flac"), audio))
+            for file in folder:
+                search_files.append({"filename": f"Music\\{album_name}\\{file.filename}", "size": 1, "bitDepth": 16, "sampleRate": 44100})
+    return {
+        "album_match": (lambda tracks, files: soularr.album_match(tracks, files, "user", "flac"), album_match_calls),
+        "match_tracks": (soularr.match_tracks, match_tracks_calls),
+        "filetype_match": (lambda file: [spec.matches(file) for spec in soularr.filetype_specs], [(file,) for file in search_files]),
+        "album_track_num": (soularr.album_track_num, [(directory,) for directory in directories]),
+        "download_filter": (lambda directory: soularr.download_filter("flac", directory), [(directory,) for directory in directories]),
+    }
+
+
+def measure(function, calls, samples, min_time, repeats):
+    """
+    Times full passes over all calls until at least repeats passes and min_time seconds are done.
+    Every pass runs the same calls, so the fastest one is the least disturbed by the rest of the
+    machine. Returns the ops/sec of the fastest and the median pass, how far apart they are in
+    percent, per-call percentiles in microseconds from batches of the calls and the peak memory of
+    one pass.
+    """
+    if not calls:
+        return None
+    batch = max(1, len(calls) // samples)
+    per_call = []
+    pass_times = []
+    while sum(pass_times) < min_time or len(pass_times) < repeats:
+        pass_time = 0.0
+        for index in range(0, len(calls), batch):
+            chunk = calls[index : index + batch]
+            start = time.perf_counter()
+            for args in chunk:
+                function(*args)
+            elapsed = time.perf_counter() - start
+            per_call.append(elapsed / len(chunk) * 1e6)
+            pass_time += elapsed
+        pass_times.append(pass_time)
+
+    tracemalloc.start()
+    for args in calls:
+        function(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    fastest = min(pass_times)
+    median = statistics.median(pass_times)
+    return {
+        "calls": len(calls),
+        "ops_per_sec": round(len(calls) / fastest, 1),
+        "median_ops_per_sec": round(len(calls) / median, 1),
+        "noise_pct": round((median - fastest) / median * 100, 1),
+        "p50_us": round(statistics.median(per_call), 2),
+        "p90_us": round(percentile(per_call, 0.9), 2),
+        "p99_us": round(percentile(per_call, 0.99), 2),
+        "peak_kib": round(peak / 1024, 1),
+    }
+
+
+def compare(results, baseline, tolerance):
+    """
+    Prints the change of the fastest pass against the baseline. A benchmark only counts as a
+    regression when it got slower than tolerance percent plus the noise measured in both runs.
+    Returns the names of the regressions.
+    """
+    regressions = []
+    print(f"\nCompared to baseline (tolerance {tolerance}% plus the noise of both runs):")
+    for name, result in results.items():
+        before = baseline.get(name)
+        if before is None or result is None:
+            continue
+        change = (result["ops_per_sec"] - before["ops_per_sec"]) / before["ops_per_sec"] * 100
+        allowed = tolerance + result["noise_pct"] + before.get("noise_pct", 0)
+        flag = ""
+        if change < -allowed:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print(f"  {name:<40} {before['ops_per_sec']:>12.1f} -> {result['ops_per_sec']:>12.1f} ops/s ({change:+.1f}%, allowed -{allowed:.1f}%){flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Matching micro-benchmarks")
+    parser.add_argument("--albums", type=int, default=3, help="albums per track count")
+    parser.add_argument("--folders", type=int, default=20, help="candidate folders per album")
+    parser.add_argument("--track-counts", default="5,12,30", help="comma separated album sizes to generate")
+    parser.add_argument("--extra-files", type=int, default=3, help="non-audio files per folder")
+    parser.add_argument("--unicode-rate", type=float, default=0.2, help="share of title words that are non-ASCII")
+    parser.add_argument("--directory-cache", help="soularr_cache.db to add recorded folders from")
+    parser.add_argument("--directory-limit", type=int, default=500, help="maximum recorded folders to load")
+    parser.add_argument("--backend", default="difflib", help="match_backend (difflib or rapidfuzz)")
+    parser.add_argument("--ratio", type=float, default=0.8, help="minimum_filename_match_ratio")
+    parser.add_argument("--samples", type=int, default=50, help="timed batches per pass")
+    parser.add_argument("--min-time", type=float, default=1.0, help="minimum seconds to run each benchmark")
+    parser.add_argument("--repeats", type=int, default=5, help="minimum passes over all calls per benchmark")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--baseline", help="JSON file from --save-baseline to compare against")
+    parser.add_argument("--tolerance", type=float, default=10.0, help="allowed ops/sec drop in percent on top of the measured noise")
+    parser.add_argument("--save-baseline", help="write the results to this JSON file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    rng = random.Random(args.seed)
+    corpora = {}
+    for tracks in [int(count) for count in args.track_counts.split(",")]:
+        corpora[f"{tracks} tracks"] = build_corpus(rng, args.albums, args.folders, tracks, args.unicode_rate, args.extra_files)
+    if args.directory_cache:
+        corpora["recorded"] = load_directory_cache(args.directory_cache, args.directory_limit)
+
+    soularr.allowed_filetypes = ALLOWED_FILETYPES
+    soularr.filetype_specs = [soularr.FiletypeSpec(filetype) for filetype in ALLOWED_FILETYPES]
+    soularr.filetype_index = soularr.build_filetype_index(soularr.filetype_specs)
+    soularr.download_filtering = True
+    soularr.use_extension_whitelist = True
+    soularr.extensions_whitelist = ["lrc", "nfo", "txt"]
+
+    results = {}
+    print(f"Backend: {args.backend}")
+    print(f"{'benchmark':<40} {'calls':>7} {'best ops/s':>12} {'median ops/s':>13} {'noise':>7} {'p50 us':>10} {'p90 us':>10} {'p99 us':>10} {'peak KiB':>10}")
+    for corpus_name, corpus in corpora.items():
+        install(corpus, args.backend, args.ratio)
+        for function_name, (function, calls) in prepare(corpus).items():
+            name = f"{function_name} [{corpus_name}]"
+            result = measure(function, calls, args.samples, args.min_time, args.repeats)
+            results[name] = result
+            if result is None:
+                print(f"{name:<40} {'no calls':>7}")
+                continue
+            print(
+                f"{name:<40} {result['calls']:>7} {result['ops_per_sec']:>12.1f} {result['median_ops_per_sec']:>13.1f} {result['noise_pct']:>6.1f}% {result['p50_us']:>10.2f} "
+                f"{result['p90_us']:>10.2f} {result['p99_us']:>10.2f} {result['peak_kib']:>10.1f}"
+            )
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as file:
+            json.dump({"backend": args.backend, "results": results}, file, indent=2)
+        print(f"\nSaved baseline to {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        if baseline.get("backend") != args.backend:
+            print(f"Warning: baseline was recorded with the {baseline.get('backend')} backend")
+        regressions = compare(results, baseline["results"], args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} benchmarks are slower than the baseline allows")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""
+Folder corpora for the matching benchmarks.
+
+build_corpus generates albums and candidate folders with the kind of filenames found on
+Soulseek: track number prefixes, underscores, scene tags, unicode titles. load_directory_cache
+reads real folder listings recorded by Soularr's directory cache (directory_cache_ttl).
+"""
+
+import json
+import os
+import re
+import sqlite3
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import soularr  # noqa: E402
+
+WORDS = ["love", "night", "blue", "fire", "dream", "river", "heart", "light", "city", "rain", "gold", "ghost", "summer", "road", "echo", "stone"]
+UNICODE_WORDS = ["café", "naïve", "über", "søren", "ĳsland", "mañana", "夜", "東京", "Ωmega", "łódź"]
+SCENE_TAGS = ["WEB", "FLAC", "2019", "CD", "16BIT", "24BIT", "VINYL", "PROPER", "REMASTERED", "LOSSLESS"]
+# How often each messy_filename style is picked for a folder. The first, second and fourth styles keep the
+# title at the end of the name and match at the default ratio; the others are what album_match rightly misses
+STYLE_WEIGHTS = (5, 2, 1, 4, 1, 1)
+
+
+def title(rng, words=3, unicode_rate=0.0):
+    return " ".join((rng.choice(UNICODE_WORDS) if rng.random() < unicode_rate else rng.choice(WORDS).capitalize()) for _ in range(rng.randint(1, words)))
+
+
+def messy_filename(rng, number, track_title, artist, extension, style):
+    if style == 0:
+        name = f"{number:02d} - {track_title}"
+    elif style == 1:
+        name = f"{number:02d}_{artist}_{track_title}".replace(" ", "_")
+    elif style == 2:
+        name = f"{artist} - {number:02d} - {track_title} [WEB]"
+    elif style == 3:
+        name = f"{number:02d}. {track_title}"
+    elif style == 4:
+        # Scene release naming
+        tags = "-".join(rng.sample(SCENE_TAGS, 2))
+        name = f"{number:02d}-{artist}-{track_title}-{tags}".replace(" ", "_").lower()
+    else:
+        name = f"{artist} - {track_title} ({number})"
+    return f"{name}.{extension}"
+
+
+def build_corpus(rng, albums, folders, tracks, unicode_rate=0.0, extra_files=0):
+    """
+    Returns [(album name, lidarr tracks, [candidate folders])]. Each folder is a list of
+    {"filename": ...} dicts named in one style, like a real rip. Roughly a fifth of the folders
+    are the right album, the rest are other albums with the same track count or other editions
+    with some tracks swapped. Most right folders match at the default ratio.
+    extra_files adds that many non-audio files (covers, logs, cue sheets) to every folder.
+    """
+    corpus = []
+    for album_id in range(albums):
+        artist = title(rng, 2, unicode_rate)
+        album_name = title(rng, 3, unicode_rate)
+        lidarr_tracks = [{"albumId": album_id, "title": title(rng, 4, unicode_rate)} for _ in range(tracks)]
+        candidates = []
+        for _ in range(folders):
+            kind = rng.random()
+            if kind < 0.2:  # The right album
+                names = [t["title"] for t in lidarr_tracks]
+            elif kind < 0.6:  # Same track count, different album
+                names = [title(rng, 4, unicode_rate) for _ in lidarr_tracks]
+            else:  # Partially right, e.g. another edition
+                names = [t["title"] if rng.random() < 0.7 else title(rng, 4, unicode_rate) for t in lidarr_tracks]
+            style = rng.choices(range(len(STYLE_WEIGHTS)), weights=STYLE_WEIGHTS)[0]
+            files = [{"filename": messy_filename(rng, i + 1, name, artist, "flac", style)} for i, name in enumerate(names)]
+            files += [{"filename": rng.choice(["cover.jpg", "folder.png", "rip.log", f"{album_name}.cue", "info.nfo"])} for _ in range(extra_files)]
+            rng.shuffle(files)
+            candidates.append(files)
+        corpus.append((album_name, lidarr_tracks, candidates))
+    return corpus
+
+
+def load_directory_cache(path, limit=None):
+    """
+    Reads folder listings recorded in the directories table of a soularr_cache.db.
+    Returns [(album name, lidarr tracks, [folder])]. We don't know the Lidarr album these folders
+    were browsed for, so the tracks are rebuilt from the folder's own audio filenames, which gives
+    album_match real filenames to chew on.
+    """
+    db = sqlite3.connect(path)
+    try:
+        rows = db.execute("SELECT key, value FROM directories" + (f" LIMIT {int(limit)}" if limit else "")).fetchall()
+    finally:
+        db.close()
+    corpus = []
+    for album_id, (key, value) in enumerate(rows):
+        username, file_dir = json.loads(key)
+        files = json.loads(value)["files"]
+        audio = [file for file in files if file["filename"].rsplit(".", 1)[-1].lower() in ("flac", "mp3", "m4a", "ogg", "opus", "wav")]
+        if not audio:
+            continue
+        lidarr_tracks = [
+            {"albumId": album_id, "title": re.sub(r"^[\d\s._-]+", "", file["filename"].rsplit(".", 1)[0]) or file["filename"]} for file in audio
+        ]
+        corpus.append((file_dir.rsplit("\\", 1)[-1], lidarr_tracks, [files]))
+    return corpus
+
+
+class StaticLidarr:
+    """
+    Stands in for the pyarr client behind soularr.lidarr_cache. Only get_album is needed.
+    """
+
+    def __init__(self, corpus=()):
+        self.albums = {}
+        for album_name, lidarr_tracks, _ in corpus:
+            self.add(lidarr_tracks[0]["albumId"], album_name)
+
+    def add(self, album_id, album_name):
+        self.albums[album_id] = {"title": album_name, "artist": {"artistName": ""}}
+
+    def get_album(self, album_id):
+        return self.albums[album_id]
+
+
+def install(corpus, backend="difflib", ratio=0.8):
+    """
+    Points soularr's globals at the corpus so album_match and friends can run without Lidarr or slskd.
+    """
+    soularr.minimum_match_ratio = ratio
+    soularr.album_filter = soularr.AlbumFilter()
+    soularr.lidarr_cache = soularr.LidarrCache(StaticLidarr(corpus), 3600)
+    soularr.match_backend = soularr.get_match_backend(backend)
+    soularr.metrics = soularr.Metrics()
@@ -0,0 +1,436 @@
+"""
+Local stand-ins for the slskd and Lidarr HTTP APIs, serving the endpoints soularr.py uses.
+
+Both are built from one synthetic Library. Every album is shared on Soulseek by a number of
+peers. Some of them have the right folder, the rest have a folder with the same track count
+but other songs. Latency, search duration, download duration and failure rates are configurable
+so bench_e2e.py can measure Soularr without a network.
+"""
+
+import json
+import random
+import re
+import struct
+import threading
+import time
+import uuid
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, unquote, urlparse
+
+WORDS = ["night", "river", "glass", "echo", "north", "silver", "fire", "dream", "stone", "light", "ocean", "ghost", "velvet", "storm", "garden", "paper", "machine", "summer", "wolf", "electric"]
+
+FILE_SIZE = 30_000_000  # Size we report for every track. The files written to disk are tiny
+
+
+def title(rng, words=2):
+    return " ".join(rng.choice(WORDS).capitalize() for _ in range(words))
+
+
+def minimal_flac():
+    """
+    The smallest file mutagen/music_tag accept as FLAC: the marker and a STREAMINFO block, no audio frames.
+    """
+    sample_rate, channels, bits_per_sample, total_samples = 44100, 2, 16, 0
+    packed = (sample_rate << 44) | ((channels - 1) << 41) | ((bits_per_sample - 1) << 36) | total_samples
+    streaminfo = struct.pack(">HH", 4096, 4096) + b"\x00" * 6 + packed.to_bytes(8, "big") + b"\x00" * 16
+    return b"fLaC" + bytes([0x80]) + len(streaminfo).to_bytes(3, "big") + streaminfo
+
+
+class Library:
+    """
+    The wanted albums in Lidarr and who shares what on Soulseek.
+    """
+
+    def __init__(self, albums=20, tracks=10, peers=8, match_rate=0.4, seed=1):
+        rng = random.Random(seed)
+        self.albums = {}
+        self.tracks = {}
+        self.shares = {}  # album id -> [(username, folder, [track titles])]
+        for album_id in range(1, albums + 1):
+            artist_name = f"{title(rng)} {album_id}"
+            album_title = f"{title(rng, 3)} {album_id}"
+            release_id = album_id * 10
+            self.albums[album_id] = {
+                "id": album_id,
+                "title": album_title,
+                "artistId": album_id,
+                "artist": {"id": album_id, "artistName": artist_name},
+                "releaseDate": "2001-01-01T00:00:00Z",
+                "monitored": True,
+                "releases": [
+                    {
+                        "id": release_id,
+                        "albumId": album_id,
+                        "title": album_title,
+                        "status": "Official",
+                        "country": ["Worldwide"],
+                        "format": "Digital Media",
+                        "mediumCount": 1,
+                        "trackCount": tracks,
+                        "monitored": True,
+                        "media": [{"mediumNumber": 1, "mediumFormat": "Digital Media"}],
+                    }
+                ],
+            }
+            self.tracks[album_id] = [
+                {"id": release_id * 100 + number, "albumId": album_id, "title": title(rng, 3), "mediumNumber": 1, "trackNumber": str(number)}
+                for number in range(1, tracks + 1)
+            ]
+            shares = []
+            for peer in range(peers):
+                username = f"peer{album_id}_{peer}"
+                folder = f"@@share\\Music\\{artist_name}\\{album_title} [{peer}]"
+                if rng.random() < match_rate:
+                    names = [track["title"] for track in self.tracks[album_id]]
+                else:
+                    names = [title(rng, 3) for _ in range(tracks)]
+                shares.append((username, folder, names))
+            self.shares[album_id] = shares
+        self.peer_attributes = {
+            username: {"uploadSpeed": rng.randint(50_000, 5_000_000), "queueLength": rng.randint(0, 20), "hasFreeUploadSlot": rng.random() < 0.6}
+            for shares in self.shares.values()
+            for username, _, _ in shares
+        }
+
+    def find_album(self, text):
+        """
+        The album whose title appears as whole words in a search query or import path.
+        """
+        for album in self.albums.values():
+            if re.search(r"\b" + re.escape(album["title"]) + r"\b", text, re.IGNORECASE):
+                return album
+        return None
+
+
+class FakeService:
+    """
+    Threaded HTTP server with a list of (method, regex, handler) routes. Counts calls per route.
+    """
+
+    name = "service"
+
+    def __init__(self, latency=0.0, seed=1):
+        self.latency = latency
+        self.rng = random.Random(seed)
+        self.lock = threading.RLock()
+        self.calls = Counter()
+        self.routes = []
+        self.server = None
+
+    def route(self, method, pattern, handler):
+        self.routes.append((method, re.compile(pattern + "$"), handler))
+
+    def chance(self, rate):
+        with self.lock:
+            return self.rng.random() < rate
+
+    def start(self):
+        service = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def handle_method(self, method):
+                url = urlparse(self.path)
+                length = int(self.headers.get("Content-Length") or 0)
+                body = json.loads(self.rfile.read(length)) if length else None
+                for route_method, pattern, handler in service.routes:
+                    found = pattern.match(url.path)
+                    if route_method == method and found:
+                        with service.lock:
+                            service.calls[f"{method} {pattern.pattern[:-1]}"] += 1
+                        if service.latency:
+                            time.sleep(service.latency)
+                        status, payload = handler(*[unquote(group) for group in found.groups()], query=parse_qs(url.query), body=body)
+                        break
+                else:
+                    status, payload = 404, {"error": f"{method} {url.path} is not faked"}
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                self.handle_method("GET")
+
+            def do_POST(self):
+                self.handle_method("POST")
+
+            def do_PUT(self):
+                self.handle_method("PUT")
+
+            def do_DELETE(self):
+                self.handle_method("DELETE")
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name=self.name, daemon=True).start()
+        return f"http://127.0.0.1:{self.server.server_port}"
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+
+class FakeSlskd(FakeService):
+    """
+    Searches finish search_time seconds after they start. Downloads sit in the remote queue for
+    queue_time seconds, then take download_time seconds and are written to download_dir.
+    """
+
+    name = "slskd"
+
+    def __init__(self, library, download_dir, latency=0.0, search_time=0.5, queue_time=0.5, download_time=1.0, browse_failure_rate=0.0, transfer_failure_rate=0.0, seed=1):
+        super().__init__(latency, seed)
+        self.library = library
+        self.download_dir = Path(download_dir)
+        self.search_time = search_time
+        self.queue_time = queue_time
+        self.download_time = download_time
+        self.browse_failure_rate = browse_failure_rate
+        self.transfer_failure_rate = transfer_failure_rate
+        self.searches = {}
+        self.transfers = {}  # id -> transfer
+        self.flac = minimal_flac()
+        api = "/api/v0"
+        self.route("GET", api + r"/application/version", lambda query, body: (200, "0.23.0"))
+        self.route("POST", api + r"/searches", self.start_search)
+        self.route("GET", api + r"/searches/([^/]+)", self.search_state)
+        self.route("PUT", api + r"/searches/([^/]+)", self.stop_search)
+        self.route("DELETE", api + r"/searches/([^/]+)", self.delete_search)
+        self.route("GET", api + r"/searches/([^/]+)/responses", self.search_responses)
+        self.route("POST", api + r"/users/([^/]+)/directory", self.browse)
+        self.route("DELETE", api + r"/transfers/downloads/all/completed", self.remove_completed)
+        self.route("GET", api + r"/transfers/downloads/", self.all_downloads)
+        self.route("POST", api + r"/transfers/downloads/([^/]+)", self.enqueue)
+        self.route("GET", api + r"/transfers/downloads/([^/]+)", self.user_downloads)
+        self.route("GET", api + r"/transfers/downloads/([^/]+)/([^/]+)", self.get_download)
+        self.route("DELETE", api + r"/transfers/downloads/([^/]+)/([^/]+)", self.cancel_download)
+
+    def shares_for(self, search):
+        album = self.library.find_album(search["searchText"])
+        return self.library.shares[album["id"]] if album else []
+
+    def start_search(self, query, body):
+        search = {"id": body.get("id") or str(uuid.uuid4()), "searchText": body["searchText"], "started": time.monotonic(), "stopped": False}
+        with self.lock:
+            self.searches[search["id"]] = search
+        return 200, {"id": search["id"], "searchText": search["searchText"], "state": "InProgress", "isComplete": False, "responseCount": 0}
+
+    def search_state(self, search_id, query, body):
+        search = self.searches.get(search_id)
+        if search is None:
+            return 404, None
+        progress = 1.0 if search["stopped"] else min(1.0, (time.monotonic() - search["started"]) / self.search_time) if self.search_time else 1.0
+        shares = self.shares_for(search)
+        done = progress >= 1.0
+        return 200, {
+            "id": search_id,
+            "searchText": search["searchText"],
+            "state": "Completed, Succeeded" if done else "InProgress",
+            "isComplete": done,
+            "responseCount": int(len(shares) * progress),
+            "fileCount": sum(len(names) for _, _, names in shares),
+        }
+
+    def stop_search(self, search_id, query, body):
+        if search_id in self.searches:
+            self.searches[search_id]["stopped"] = True
+        return 200, None
+
+    def delete_search(self, search_id, query, body):
+        self.searches.pop(search_id, None)
+        return 204, None
+
+    def search_responses(self, search_id, query, body):
+        search = self.searches.get(search_id)
+        if search is None:
+            return 404, None
+        responses = []
+        for username, folder, names in self.shares_for(search):
+            files = [
+                {"filename": f"{folder}\\{number:02d} - {name}.flac", "size": FILE_SIZE, "bitDepth": 16, "sampleRate": 44100, "extension": "flac"}
+                for number, name in enumerate(names, 1)
+            ]
+            files.append({"filename": f"{folder}\\cover.jpg", "size": 100_000, "extension": "jpg"})
+            responses.append({"username": username, "fileCount": len(files), "files": files, "lockedFileCount": 0, "lockedFiles": [], **self.library.peer_attributes[username]})
+        return 200, responses
+
+    def browse(self, username, query, body):
+        if self.chance(self.browse_failure_rate):
+            return 500, {"error": "Peer offline"}
+        for shares in self.library.shares.values():
+            for share_user, folder, names in shares:
+                if share_user == username and folder == body["directory"]:
+                    files = [{"filename": f"{number:02d} - {name}.flac", "size": FILE_SIZE, "bitDepth": 16, "sampleRate": 44100} for number, name in enumerate(names, 1)]
+                    files.append({"filename": "cover.jpg", "size": 100_000})
+                    return 200, [{"name": folder, "fileCount": len(files), "files": files}]
+        return 500, {"error": "Directory not found"}
+
+    def enqueue(self, username, query, body):
+        now = time.monotonic()
+        with self.lock:
+            for file in body:
+                # Like slskd, enqueueing a file again replaces the earlier transfer of it
+                for transfer_id, transfer in list(self.transfers.items()):
+                    if transfer["username"] == username and transfer["filename"] == file["filename"]:
+                        del self.transfers[transfer_id]
+                transfer_id = str(uuid.uuid4())
+                self.transfers[transfer_id] = {
+                    "id": transfer_id,
+                    "username": username,
+                    "filename": file["filename"],
+                    "size": file["size"],
+                    "enqueued": now,
+                    "fails": self.rng.random() < self.transfer_failure_rate,
+                }
+        return 201, None
+
+    def status(self, transfer):
+        """
+        The transfer as slskd would report it right now. Writes the file once it is complete.
+        """
+        elapsed = time.monotonic() - transfer["enqueued"]
+        directory = transfer["filename"].rsplit("\\", 1)[0]
+        status = {key: transfer[key] for key in ("id", "username", "filename", "size")}
+        status["bytesTransferred"] = 0
+        if elapsed < self.queue_time:
+            status["state"] = "Queued, Remotely"
+        elif elapsed < self.queue_time + self.download_time:
+            status["state"] = "InProgress"
+            status["bytesTransferred"] = int(transfer["size"] * (elapsed - self.queue_time) / self.download_time) if self.download_time else 0
+        elif transfer["fails"]:
+            status["state"] = "Completed, Errored"
+        else:
+            status["state"] = "Completed, Succeeded"
+            status["bytesTransferred"] = transfer["size"]
+            if not transfer.get("written"):
+                # slskd saves into a folder named after the last part of the remote directory
+                path = self.download_dir / directory.rsplit("\\", 1)[-1] / transfer["filename"].rsplit("\\", 1)[-1]
+                path.parent.mkdir(parents=True, exist_ok=True)
+                path.write_bytes(self.flac if path.suffix == ".flac" else b"")
+                transfer["written"] = True
+        status["averageSpeed"] = status["bytesTransferred"] / elapsed if elapsed else 0
+        return directory, status
+
+    def grouped(self, username=None):
+        users = {}
+        with self.lock:
+            for transfer in self.transfers.values():
+                if username is not None and transfer["username"] != username:
+                    continue
+                directory, status = self.status(transfer)
+                users.setdefault(transfer["username"], {}).setdefault(directory, []).append(status)
+        return [
+            {"username": user, "directories": [{"directory": directory, "fileCount": len(files), "files": files} for directory, files in directories.items()]}
+            for user, directories in users.items()
+        ]
+
+    def all_downloads(self, query, body):
+        return 200, self.grouped()
+
+    def user_downloads(self, username, query, body):
+        users = self.grouped(username)
+        return 200, users[0] if users else {"username": username, "directories": []}
+
+    def get_download(self, username, transfer_id, query, body):
+        with self.lock:
+            transfer = self.transfers.get(transfer_id)
+            if transfer is None:
+                return 404, None
+            return 200, self.status(transfer)[1]
+
+    def cancel_download(self, username, transfer_id, query, body):
+        with self.lock:
+            self.transfers.pop(transfer_id, None)
+        return 204, None
+
+    def remove_completed(self, query, body):
+        with self.lock:
+            for transfer_id, transfer in list(self.transfers.items()):
+                if self.status(transfer)[1]["state"].startswith("Completed"):
+                    del self.transfers[transfer_id]
+        return 204, None
+
+
+class FakeLidarr(FakeService):
+    """
+    Serves the wanted list, queue, albums and tracks from the Library. A DownloadedAlbumsScan
+    command completes import_time seconds after it was posted and takes the album off the wanted list.
+    """
+
+    name = "lidarr"
+
+    def __init__(self, library, latency=0.0, import_time=0.2, seed=1):
+        super().__init__(latency, seed)
+        self.library = library
+        self.import_time = import_time
+        self.wanted = list(library.albums)
+        self.commands = {}
+        self.imported = []
+        api = "/api/v1"
+        self.route("GET", api + r"/wanted/(missing|cutoff)", self.get_wanted)
+        self.route("GET", api + r"/queue", self.get_queue)
+        self.route("GET", api + r"/album", self.get_albums)
+        self.route("GET", api + r"/album/(\d+)", self.get_album)
+        self.route("GET", api + r"/track", self.get_tracks)
+        self.route("POST", api + r"/command", self.post_command)
+        self.route("GET", api + r"/command/(\d+)", self.get_command)
+
+    @staticmethod
+    def page(records, query):
+        page = int(query.get("page", ["1"])[0])
+        page_size = int(query.get("pageSize", ["10"])[0])
+        return {"page": page, "pageSize": page_size, "totalRecords": len(records), "records": records[(page - 1) * page_size : page * page_size]}
+
+    def get_wanted(self, kind, query, body):
+        with self.lock:
+            records = [self.library.albums[album_id] for album_id in self.wanted] if kind == "missing" else []
+        return 200, self.page(records, query)
+
+    def get_queue(self, query, body):
+        return 200, self.page([], query)
+
+    def get_albums(self, query, body):
+        return 200, [self.library.albums[int(album_id)] for album_id in query.get("albumids", []) if int(album_id) in self.library.albums]
+
+    def get_album(self, album_id, query, body):
+        album = self.library.albums.get(int(album_id))
+        return (200, album) if album else (404, None)
+
+    def get_tracks(self, query, body):
+        return 200, self.library.tracks.get(int(query["albumId"][0]), [])
+
+    def post_command(self, query, body):
+        with self.lock:
+            command_id = len(self.commands) + 1
+            self.commands[command_id] = {"id": command_id, "name": body["name"], "body": body, "posted": time.monotonic()}
+        return 201, {"id": command_id, "name": body["name"], "commandName": body["name"], "status": "queued", "body": body}
+
+    def get_command(self, command_id, query, body):
+        with self.lock:
+            command = self.commands.get(int(command_id))
+            if command is None:
+                return 404, None
+            done = time.monotonic() - command["posted"] >= self.import_time
+            if done and not command.get("done"):
+                command["done"] = True
+                path = command["body"].get("path", "")
+                self.imported.append(path)
+                album = self.library.find_album(path)
+                if album is not None and album["id"] in self.wanted:
+                    self.wanted.remove(album["id"])
+            return 200, {
+                "id": command["id"],
+                "name": command["name"],
+                "commandName": command["name"],
+                "status": "completed" if done else "started",
+                "message": "Completed" if done else "Processing",
+                "body": command["body"],
+            }
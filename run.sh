@@ -24,6 +24,12 @@ if [ "${WEBUI_ENABLED:-true}" = "true" ]; then
     python -u /app/webui/webui.py "${_WEBUI_ARGS[@]}" "$@" &
 fi
 
+# Daemon mode runs Soularr as a single long lived process that schedules the runs itself
+if [ "${DAEMON_MODE:-false}" = "true" ]; then
+    python -u /app/soularr.py --daemon --interval "$INTERVAL" "$@"
+    exit $?
+fi
+
 while true; do
     if ps aux | grep "[s]oularr.py" > /dev/null; then
         echo "Soularr is already running. Exiting..."
@@ -7,18 +7,30 @@ import os
 import sys
 import time
 import shutil
+import signal
 import difflib
 import operator
 import configparser
+import contextlib
+import itertools
 import logging
+import gzip
 import json
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
-import copy
 import music_tag
+import requests
 import slskd_api
 from pyarr import LidarrAPI
 from slskd_api.apis import users
 
+try:
+    from rapidfuzz import fuzz as rapidfuzz_fuzz
+except ImportError:
+    rapidfuzz_fuzz = None
+
 
 class EnvInterpolation(configparser.ExtendedInterpolation):
     """
@@ -41,7 +53,9 @@ DEFAULT_LOGGING_CONF = {
 
 # === API Clients & Logging ===
 lidarr = None
+lidarr_cache = None
 slskd = None
+slskd_browse = None  # Second slskd client for folder browses, its requests time out after browse_timeout
 config = None
 logger = logging.getLogger("soularr")
 
@@ -50,6 +64,9 @@ slskd_api_key = None
 lidarr_api_key = None
 lidarr_download_dir = None
 lidarr_disable_sync = None
+import_workers = None
+import_timeout = None
+tagging_workers = None
 slskd_download_dir = None
 lidarr_host_url = None
 slskd_host_url = None
@@ -57,16 +74,33 @@ stalled_timeout = None
 remote_queue_timeout = None
 delete_searches = None
 slskd_url_base = None
-ignored_users = []
 search_type = None
 search_source = None
 download_filtering = None
 use_extension_whitelist = None
 extensions_whitelist = []
 rename_download_folders = None
+pipeline_downloads = None
+failover_grace = None
 search_sources = []
 minimum_match_ratio = None
+peer_free_slot_weight = None
+browse_prefetch = None
+peer_history_weight = None
+peer_max_failures = None
+browse_timeout = None
+peer_speed_weight = None
+peer_queue_weight = None
 minimum_search_interval = None
+parallel_searches = None
+search_settle_time = None
+early_match_exit = None
+search_cache_ttl = None
+directory_cache_ttl = None
+directory_cache_size = None
+browse_error_ttl = None
+wanted_sync_ttl = None
+lidarr_page_workers = None
 page_size = None
 failed_import_denylist = None
 failed_import_denylist_file_path = None
@@ -77,84 +111,736 @@ skip_region_check = None
 accepted_formats = []
 use_selected_lidarr_release = None
 allowed_filetypes = []
+filetype_specs = []
+filetype_index = {}
 lock_file_path = None
 config_file_path = None
 current_page_file_path = None
-search_blacklist = []
 
 # === Runtime State & Caches ===
 search_cache = {}
 folder_cache = {}
 broken_user = []
+browse_futures = {}  # (username, folder) -> browse started by prefetch_directories that nobody has used yet
+search_cache_times = {}
+folder_cache_times = {}
+search_peers = {}
+client_settings = {}
+search_rate_limiter = None
+album_filter = None
+search_result_store = None
+directory_store = None
+browse_error_store = None
+wanted_store = None
+peer_stats = None
+match_backend = None
+cassette = None
+clock = time  # What Soularr measures and waits with. A ScaledClock during --replay
+metrics = None
+tracer = None
+failed_import_denylist_lock = threading.Lock()
+match_lock = threading.Lock()  # Guards folder_cache, broken_user and browse_futures while an album is matched  # Import workers can add to the denylist at the same time
+
+# === Search Polling ===
+SEARCH_POLL_INITIAL = 0.25  # First delay between search state checks (seconds). Doubles every check
+SEARCH_POLL_MAX = 5  # Upper bound for the delay between search state checks (seconds)
+SEARCH_DEADLINE_GRACE = 60  # Time (seconds) on top of search_timeout before we give up on a search
+
+QUEUE_PAGE_SIZE = 250  # Records per request when reading the Lidarr queue
+METRICS_WRITE_INTERVAL = 15  # Minimum time (seconds) between two writes of the metrics file during a run
+TRACE_MAX_BYTES = 10 * 1024 * 1024  # Size at which the trace file is moved to .1 and a new one started
+
+
+class TokenBucket:
+    """
+    Thread safe token bucket. Used to rate limit the start of searches so that
+    minimum_search_interval holds no matter how many searches are in flight.
+    """
+
+    def __init__(self, interval, capacity=1):
+        self.interval = interval
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = clock.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        if self.interval <= 0:
+            return
+        while True:
+            with self.lock:
+                now = clock.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) / self.interval)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) * self.interval
+            logger.debug(f"Waiting {wait:.1f}s to meet minimum_search_interval")
+            clock.sleep(wait)
+
+
+class LidarrCache:
+    """
+    Caches Lidarr albums (including their releases) and release tracklists for the run so
+    the same album isn't fetched over and over while matching. Entries expire after ttl
+    seconds, a ttl of 0 disables caching. Cached objects are shared, don't modify them.
+    """
+
+    BATCH_SIZE = 50  # Album ids per bulk request. Keeps the query string at a sane length
+
+    def __init__(self, client, ttl):
+        self.client = client
+        self.ttl = ttl
+        self.albums = {}
+        self.tracks = {}
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def _lookup(self, cache, key):
+        with self.lock:
+            entry = cache.get(key)
+            if entry is not None and clock.monotonic() - entry[0] < self.ttl:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            return None
+
+    def _store(self, cache, key, value):
+        if self.ttl > 0:
+            with self.lock:
+                cache[key] = (clock.monotonic(), value)
+        return value
+
+    def get_album(self, album_id):
+        album = self._lookup(self.albums, album_id)
+        if album is None:
+            album = self._store(self.albums, album_id, self.client.get_album(album_id))
+        return album
+
+    def get_albums(self, album_ids):
+        """
+        Fetches every album that isn't cached yet with one request per BATCH_SIZE ids. The bulk
+        results are returned directly, so with a ttl of 0 nothing is fetched a second time.
+        """
+        with self.lock:
+            now = clock.monotonic()
+            cold = [album_id for album_id in dict.fromkeys(album_ids) if album_id not in self.albums or now - self.albums[album_id][0] >= self.ttl]
+        fetched = {}
+        for i in range(0, len(cold), self.BATCH_SIZE):
+            for album in self.client.get_album(albumIds=cold[i : i + self.BATCH_SIZE]):
+                fetched[album["id"]] = self._store(self.albums, album["id"], album)
+        return [fetched[album_id] if album_id in fetched else self.get_album(album_id) for album_id in album_ids]
+
+    def get_tracks(self, artist_id, album_id, release_id):
+        key = (album_id, release_id)
+        tracks = self._lookup(self.tracks, key)
+        if tracks is None:
+            tracks = self._store(self.tracks, key, self.client.get_tracks(artistId=artist_id, albumId=album_id, albumReleaseId=release_id))
+        return tracks
+
+    def invalidate(self, album_id):
+        with self.lock:
+            self.albums.pop(album_id, None)
+            for key in [key for key in self.tracks if key[0] == album_id]:
+                del self.tracks[key]
+
+
+class SqliteStore:
+    """
+    Small key/value store kept in a SQLite table in the var dir. Values are stored as JSON along
+    with the time they were written so callers can apply their own TTL. Safe to share between threads.
+    """
+
+    def __init__(self, path, table):
+        self.table = table
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.db:
+            self.db.execute(f"CREATE TABLE IF NOT EXISTS {table} (key TEXT PRIMARY KEY, value TEXT NOT NULL, updated REAL NOT NULL)")
+
+    def get(self, key, ttl=None):
+        with self.lock:
+            row = self.db.execute(f"SELECT value, updated FROM {self.table} WHERE key = ?", (key,)).fetchone()
+        if row is None or (ttl is not None and clock.time() - row[1] >= ttl):
+            return None
+        return json.loads(row[0])
+
+    def set(self, key, value):
+        with self.lock, self.db:
+            self.db.execute(f"INSERT OR REPLACE INTO {self.table} (key, value, updated) VALUES (?, ?, ?)", (key, json.dumps(value), clock.time()))
+
+    def delete(self, key):
+        with self.lock, self.db:
+            self.db.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+
+    def prune(self, ttl=None, max_entries=None):
+        """
+        Drops entries older than ttl seconds, then the oldest entries above max_entries.
+        """
+        with self.lock, self.db:
+            if ttl is not None:
+                self.db.execute(f"DELETE FROM {self.table} WHERE updated < ?", (clock.time() - ttl,))
+            if max_entries is not None:
+                self.db.execute(
+                    f"DELETE FROM {self.table} WHERE key NOT IN (SELECT key FROM {self.table} ORDER BY updated DESC LIMIT ?)",
+                    (max_entries,),
+                )
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+    def items(self):
+        with self.lock:
+            rows = self.db.execute(f"SELECT key, value FROM {self.table}").fetchall()
+        return [(key, json.loads(value)) for key, value in rows]
+
+
+class PeerStats:
+    """
+    What we learned about each Soulseek user across runs: downloads that finished or failed,
+    why transfers failed, browse errors, throughput and time to first byte.
+    Kept in memory and written through to a SqliteStore.
+    """
+
+    COUNTERS = ("successes", "failures", "rejected", "timed_out", "remote_queued", "browse_errors", "bytes", "seconds", "first_byte_seconds")
+
+    def __init__(self, store):
+        self.store = store
+        self.lock = threading.Lock()
+        self.stats = dict(store.items())
+
+    def get(self, username):
+        return self.stats.get(username)
+
+    def record(self, username, **counts):
+        with self.lock:
+            stats = dict(self.stats.get(username) or dict.fromkeys(self.COUNTERS, 0))
+            for key, value in counts.items():
+                stats[key] = stats.get(key, 0) + value
+            self.stats[username] = stats
+        self.store.set(username, stats)
+
+    @staticmethod
+    def speed(stats):
+        """
+        Average bytes per second over all finished downloads, or None if we never finished one.
+        """
+        if not stats or stats["seconds"] <= 0:
+            return None
+        return stats["bytes"] / stats["seconds"]
+
+    @staticmethod
+    def reliability(stats):
+        """
+        Between -1 (only ever failed) and 1 (only ever delivered). 0 without any history.
+        """
+        if not stats:
+            return 0.0
+        failed = stats["failures"] + stats["browse_errors"]
+        return (stats["successes"] - failed) / (stats["successes"] + failed + 1)
+
+
+class Metrics:
+    """
+    Counters, gauges and histograms written to a file in the Prometheus text format. The web UI serves it at /metrics.
+    The values are also kept in a JSON file next to it so counters keep going up across runs outside daemon mode.
+    Nothing is written until open() is given a path.
+    """
+
+    # name: (type, help, histogram buckets)
+    DEFINITIONS = {
+        "cycle_seconds": ("histogram", "Duration of a full run", (30, 60, 120, 300, 600, 1200, 1800, 3600, 7200)),
+        "search_seconds": ("histogram", "Time from starting a search to having its results", (1, 2, 5, 10, 15, 30, 60, 120)),
+        "browse_seconds": ("histogram", "Time to browse a folder of another user", (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)),
+        "album_match_cpu_seconds": ("histogram", "CPU time of one album_match call", (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5)),
+        "download_seconds": ("histogram", "Time from enqueueing an album to its last file completing", (60, 300, 600, 1200, 1800, 3600, 7200, 14400)),
+        "import_seconds": ("histogram", "Duration of the Lidarr import command", (1, 2, 5, 10, 30, 60, 120, 300, 600)),
+        "searches_total": ("counter", "Searches sent to slskd", None),
+        "matches_total": ("counter", "Albums a matching folder was found and enqueued for", None),
+        "requeues_total": ("counter", "Files requeued after a failed download", None),
+        "timeouts_total": ("counter", "Searches, browses, downloads and imports that ran out of time", None),
+        "failed_imports_total": ("counter", "Albums Lidarr failed to import", None),
+        "grab_list_albums": ("gauge", "Albums being downloaded", None),
+        "cache_entries": ("gauge", "Entries in the in-memory caches", None),
+    }
+
+    def __init__(self):
+        self.path = None
+        self.values = {}
+        self.saved_at = 0.0
+        self.lock = threading.Lock()
+
+    @property
+    def state_path(self):
+        return os.path.splitext(self.path)[0] + ".json"
+
+    def open(self, path):
+        """
+        Starts writing to path, or stops writing when path is None. Picks up the values a previous run left behind.
+        """
+        if path == self.path:
+            return
+        with self.lock:
+            self.path = path
+            if path is None:
+                return
+            try:
+                with open(self.state_path) as file:
+                    self.values = json.load(file)
+            except FileNotFoundError:
+                pass
+            except (OSError, ValueError):
+                logger.warning(f"Could not read {self.state_path}. Metrics start from zero", exc_info=True)
+
+    @staticmethod
+    def _labels(labels):
+        return ",".join(f'{key}="{value}"' for key, value in sorted(labels.items()))
+
+    def inc(self, name, amount=1, **labels):
+        with self.lock:
+            series = self.values.setdefault(name, {})
+            key = self._labels(labels)
+            series[key] = series.get(key, 0) + amount
+
+    def set(self, name, value, **labels):
+        with self.lock:
+            self.values.setdefault(name, {})[self._labels(labels)] = value
+
+    def observe(self, name, value, **labels):
+        buckets = self.DEFINITIONS[name][2]
+        with self.lock:
+            series = self.values.setdefault(name, {})
+            key = self._labels(labels)
+            histogram = series.get(key)
+            if histogram is None or len(histogram["buckets"]) != len(buckets):
+                histogram = series[key] = {"buckets": [0] * len(buckets), "sum": 0.0, "count": 0}
+            # Buckets are cumulative like in the exposition format
+            for index, bound in enumerate(buckets):
+                if value <= bound:
+                    histogram["buckets"][index] += 1
+            histogram["sum"] += value
+            histogram["count"] += 1
+
+    def render(self):
+        lines = []
+        for name, (kind, description, buckets) in self.DEFINITIONS.items():
+            series = self.values.get(name)
+            if not series:
+                continue
+            lines.append(f"# HELP soularr_{name} {description}")
+            lines.append(f"# TYPE soularr_{name} {kind}")
+            for labels, value in sorted(series.items()):
+                selector = f"{{{labels}}}" if labels else ""
+                if kind != "histogram":
+                    lines.append(f"soularr_{name}{selector} {value}")
+                    continue
+                prefix = labels + "," if labels else ""
+                for bound, count in zip(buckets, value["buckets"]):
+                    lines.append(f'soularr_{name}_bucket{{{prefix}le="{bound}"}} {count}')
+                lines.append(f'soularr_{name}_bucket{{{prefix}le="+Inf"}} {value["count"]}')
+                lines.append(f"soularr_{name}_sum{selector} {value['sum']}")
+                lines.append(f"soularr_{name}_count{selector} {value['count']}")
+        return "\n".join(lines) + "\n"
+
+    def save(self, force=False):
+        """
+        Writes the metrics file and the state file. Unless forced, at most every METRICS_WRITE_INTERVAL seconds.
+        """
+        with self.lock:
+            if self.path is None or (not force and clock.monotonic() - self.saved_at < METRICS_WRITE_INTERVAL):
+                return
+            self.saved_at = clock.monotonic()
+            try:
+                for path, content in ((self.path, self.render()), (self.state_path, json.dumps(self.values))):
+                    with open(path + ".tmp", "w") as file:
+                        file.write(content)
+                    os.replace(path + ".tmp", path)
+            except OSError:
+                logger.warning(f"Could not write metrics to {self.path}", exc_info=True)
+
+
+class Tracer:
+    """
+    Writes the way each album takes through a run as nested timed spans to a JSONL file.
+    An album's root span lasts from its search until it is imported, given up on or the run ends.
+    Search, browse, match, enqueue, requeue, download, move, tag and the Lidarr import are spans under it.
+    The web UI reads the file to show the slowest albums. Nothing is written until open() is given a path.
+    """
+
+    def __init__(self):
+        self.path = None
+        self.file = None
+        self.albums = {}
+        self.ids = itertools.count(1)
+        self.run = f"{int(clock.time()):x}"
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def open(self, path):
+        """
+        Starts writing to path, or stops writing when path is None.
+        """
+        if path == self.path:
+            return
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+            self.path = path
+            if path is not None:
+                self._rotate()
+
+    def _rotate(self):
+        """
+        (Re)opens the trace file. Once it reaches TRACE_MAX_BYTES it is moved to .1 and a new one is started.
+        """
+        if self.file is not None:
+            self.file.close()
+        if os.path.exists(self.path) and os.path.getsize(self.path) >= TRACE_MAX_BYTES:
+            os.replace(self.path, self.path + ".1")
+        self.file = open(self.path, "a", encoding="utf-8")
+
+    def _span(self, name, parent, attrs):
+        span_id = f"{self.run}-{next(self.ids)}"
+        return {
+            "trace": parent["trace"] if parent else span_id,
+            "id": span_id,
+            "parent": parent["id"] if parent else None,
+            "name": name,
+            "album_id": parent["album_id"] if parent else None,
+            "album": parent["album"] if parent else None,
+            "start": clock.time(),
+            "started": clock.monotonic(),
+            "attrs": attrs,
+        }
+
+    def _write(self, span, duration):
+        record = {key: value for key, value in span.items() if key != "started"}
+        record["start"] = round(span["start"], 3)
+        record["duration"] = round(duration, 3)
+        with self.lock:
+            if self.file is not None:
+                self.file.write(json.dumps(record) + "\n")
+                self.file.flush()
+                # Checked on every write, a daemon may go a long time between open() calls
+                if self.file.tell() >= TRACE_MAX_BYTES:
+                    self._rotate()
+
+    def _parent(self, album_id):
+        parent = getattr(self.local, "span", None)
+        if album_id is not None and (parent is None or parent["album_id"] != album_id):
+            parent = self.albums.get(album_id)
+        return parent
+
+    def start_album(self, album_id, album):
+        if self.file is None:
+            return
+        span = self._span("album", None, {})
+        span["album_id"] = album_id
+        span["album"] = album
+        with self.lock:
+            previous = self.albums.pop(album_id, None)
+            self.albums[album_id] = span
+        if previous is not None:
+            self._write(previous, clock.monotonic() - previous["started"])
+
+    def end_album(self, album_id, **attrs):
+        with self.lock:
+            span = self.albums.pop(album_id, None)
+        if span is not None:
+            span["attrs"].update(attrs)
+            self._write(span, clock.monotonic() - span["started"])
+
+    @contextlib.contextmanager
+    def span(self, name, album_id=None, **attrs):
+        """
+        Times the block as a span under the one open on this thread, or under the album's root span.
+        Yields the span's attributes so the block can add to them.
+        """
+        parent = self._parent(album_id)
+        if self.file is None or parent is None:
+            yield attrs
+            return
+        span = self._span(name, parent, attrs)
+        previous = getattr(self.local, "span", None)
+        self.local.span = span
+        try:
+            yield attrs
+        except Exception as ex:
+            attrs["error"] = type(ex).__name__
+            raise
+        finally:
+            self.local.span = previous
+            self._write(span, clock.monotonic() - span["started"])
+
+    def record(self, name, album_id, duration, **attrs):
+        """
+        Writes a span that already ended, duration seconds long, for work that can't be wrapped in a with block.
+        """
+        parent = self._parent(album_id)
+        if self.file is None or parent is None:
+            return
+        span = self._span(name, parent, attrs)
+        span["start"] -= duration
+        self._write(span, duration)
+
+    def bind(self, function):
+        """
+        Wraps function so the spans it records on a worker thread go under the span open on this thread.
+        """
+        parent = getattr(self.local, "span", None)
+
+        def wrapper(*args, **kwargs):
+            self.local.span = parent
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.local.span = None
+
+        return wrapper
+
+    def finish(self):
+        """
+        Ends the root spans of every album that is still open at the end of a run.
+        """
+        for album_id in list(self.albums):
+            self.end_album(album_id, status="unfinished")
+        with self.lock:
+            if self.path is not None:
+                self._rotate()
+
+
+class SlskdFile:
+    """
+    One file of a browsed folder, keeping only the fields Soularr uses.
+    The same object is shared by the folder cache, matching and enqueueing so it is never modified.
+    """
+
+    __slots__ = ("filename", "size", "bitrate", "bitdepth", "samplerate")
+
+    def __init__(self, filename, size=0, bitrate=None, bitdepth=None, samplerate=None):
+        self.filename = filename
+        self.size = size
+        self.bitrate = bitrate
+        self.bitdepth = bitdepth
+        self.samplerate = samplerate
+
+    @property
+    def extension(self):
+        return self.filename.split(".")[-1]
+
+    @classmethod
+    def from_json(cls, file):
+        return cls(file["filename"], file.get("size", 0), file.get("bitRate"), file.get("bitDepth"), file.get("sampleRate"))
+
+    def to_json(self):
+        # Same keys as the slskd API so both can be read back with from_json
+        file = {"filename": self.filename, "size": self.size}
+        for key, value in (("bitRate", self.bitrate), ("bitDepth", self.bitdepth), ("sampleRate", self.samplerate)):
+            if value is not None:
+                file[key] = value
+        return file
+
+    def enqueue_entry(self, file_dir):
+        """
+        The request body slskd wants for this file, with the full remote path.
+        """
+        return {"filename": file_dir + "\\" + self.filename, "size": self.size}
+
+
+class SlskdDirectory:
+    """
+    A browsed folder. files is a tuple of SlskdFile.
+    """
+
+    __slots__ = ("name", "files")
+
+    def __init__(self, name, files):
+        self.name = name
+        self.files = tuple(files)
+
+    @classmethod
+    def from_json(cls, directory):
+        return cls(directory.get("name", ""), (SlskdFile.from_json(file) for file in directory["files"]))
+
+    def to_json(self):
+        return {"name": self.name, "files": [file.to_json() for file in self.files]}
+
+    def with_files(self, files):
+        """
+        Returns a new directory sharing the given files, e.g. after filtering.
+        """
+        return SlskdDirectory(self.name, files)
 
 
 def album_match(lidarr_tracks, slskd_tracks, username, filetype):
-    counted = []
-    total_match = 0.0
+    if username in album_filter.ignored_users:
+        return False
 
-    lidarr_album = lidarr.get_album(lidarr_tracks[0]["albumId"])
+    lidarr_album = lidarr_cache.get_album(lidarr_tracks[0]["albumId"])
     lidarr_album_name = lidarr_album["title"]
-    lidarr_artist_name = lidarr_album["artist"]["artistName"]
 
+    start_time = time.thread_time()
+    total_match = match_tracks(lidarr_track_names(lidarr_tracks, lidarr_album_name, filetype), slskd_tracks)
+    metrics.observe("album_match_cpu_seconds", time.thread_time() - start_time)
+    if total_match is None:
+        return False
+
+    logger.info(f"Found match from user: {username} for {len(lidarr_tracks)} tracks! Track attributes: {filetype}")
+    logger.info(f"Average sequence match ratio: {total_match / len(lidarr_tracks)}")
+    logger.info("SUCCESSFUL MATCH")
+    logger.info("-------------------")
+    return True
+
+
+def lidarr_track_names(lidarr_tracks, lidarr_album_name, filetype):
+    """
+    Precomputes the names we compare slskd filenames against for every Lidarr track.
+    Each entry is the list of (separator, name, word count) attempts in the order album_match tries them:
+    the exact filename, then split on " " and "_", then the same three with the album name prepended.
+    """
+    track_names = []
+    extension = filetype.split(" ")[0]
     for lidarr_track in lidarr_tracks:
-        lidarr_filename = lidarr_track["title"] + "." + filetype.split(" ")[0]
-        best_match = 0.0
+        lidarr_filename = lidarr_track["title"] + "." + extension
+        album_filename = lidarr_album_name + " " + lidarr_filename
+        word_count = len(lidarr_filename.split())
+        album_word_count = len(album_filename.split())
+        track_names.append(
+            [
+                ("", lidarr_filename, 0),
+                (" ", lidarr_filename, word_count),
+                ("_", lidarr_filename, word_count),
+                ("", album_filename, 0),
+                (" ", album_filename, album_word_count),
+                ("_", album_filename, album_word_count),
+            ]
+        )
+    return track_names
 
-        for slskd_track in slskd_tracks:
-            slskd_filename = slskd_track["filename"]
 
-            # Try to match the ratio with the exact filenames
-            ratio = difflib.SequenceMatcher(None, lidarr_filename, slskd_filename).ratio()
+class DifflibBackend:
+    """
+    Pure Python matcher backend. Gives exactly the same ratios as the original difflib checks.
+    A prepared slskd name is a SequenceMatcher with that name as the second sequence so difflib
+    only builds its lookup tables for it once.
+    """
 
-            # If ratio is a bad match try and split off (with " " as the separator) the garbage at the start of the slskd_filename and try again
-            ratio = check_ratio(" ", ratio, lidarr_filename, slskd_filename)
-            # Same but with "_" as the separator
-            ratio = check_ratio("_", ratio, lidarr_filename, slskd_filename)
+    name = "difflib"
 
-            # Same checks but preappend album name.
-            ratio = check_ratio("", ratio, lidarr_album_name + " " + lidarr_filename, slskd_filename)
-            ratio = check_ratio(" ", ratio, lidarr_album_name + " " + lidarr_filename, slskd_filename)
-            ratio = check_ratio("_", ratio, lidarr_album_name + " " + lidarr_filename, slskd_filename)
+    def prepare(self, slskd_filename):
+        return difflib.SequenceMatcher(None, "", slskd_filename)
 
-            if ratio > best_match:
-                best_match = ratio
+    def ratio(self, prepared, lidarr_filename, cutoff):
+        """
+        Returns the ratio, or -1.0 when the cheap upper bounds already show it is below cutoff.
+        """
+        prepared.set_seq1(lidarr_filename)
+        if prepared.real_quick_ratio() < cutoff or prepared.quick_ratio() < cutoff:
+            return -1.0
+        return prepared.ratio()
 
-        if best_match > minimum_match_ratio:
-            counted.append(lidarr_filename)
-            total_match += best_match
 
-    if len(counted) == len(lidarr_tracks) and username not in ignored_users:
-        logger.info(f"Found match from user: {username} for {len(counted)} tracks! Track attributes: {filetype}")
-        logger.info(f"Average sequence match ratio: {total_match / len(counted)}")
-        logger.info("SUCCESSFUL MATCH")
-        logger.info("-------------------")
-        return True
+class RapidfuzzBackend:
+    """
+    Matcher backend using the compiled rapidfuzz library. Its ratio is based on the longest
+    common subsequence, so scores can be slightly higher than difflib for the same names.
+    """
 
-    return False
+    name = "rapidfuzz"
 
+    def prepare(self, slskd_filename):
+        return slskd_filename
 
-def check_ratio(separator, ratio, lidarr_filename, slskd_filename):
-    if ratio < minimum_match_ratio:
-        if separator != "":
-            lidarr_filename_word_count = len(lidarr_filename.split()) * -1
-            truncated_slskd_filename = " ".join(slskd_filename.split(separator)[lidarr_filename_word_count:])
-            ratio = difflib.SequenceMatcher(None, lidarr_filename, truncated_slskd_filename).ratio()
-        else:
-            ratio = difflib.SequenceMatcher(None, lidarr_filename, slskd_filename).ratio()
+    def ratio(self, prepared, lidarr_filename, cutoff):
+        score = rapidfuzz_fuzz.ratio(lidarr_filename, prepared, score_cutoff=cutoff * 100)
+        # rapidfuzz returns 0 for anything below the cutoff
+        return score / 100 if score >= cutoff * 100 else -1.0
+
+
+def get_match_backend(name):
+    """
+    difflib unless rapidfuzz is asked for explicitly. rapidfuzz scores differently, so picking it
+    just because it happens to be installed would change which folders are accepted.
+    """
+    name = name.lower().strip()
+    if name not in ("difflib", "rapidfuzz"):
+        logger.warning(f"[Search Settings] - match_backend = {name} is not valid. Using difflib")
+        return DifflibBackend()
+    if name == "rapidfuzz":
+        if rapidfuzz_fuzz is not None:
+            return RapidfuzzBackend()
+        logger.warning("match_backend is set to rapidfuzz but it is not installed. Falling back to difflib")
+    return DifflibBackend()
+
+
+class FilenameVariants:
+    """
+    The truncated forms of a single slskd filename (its last words when split on " " or "_"), each
+    prepared for the match backend. They are built on first use and shared by every Lidarr track of the folder.
+    """
+
+    __slots__ = ("filename", "parts", "prepared")
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.parts = {}
+        self.prepared = {}
+
+    def get(self, separator, word_count):
+        key = (separator, word_count)
+        prepared = self.prepared.get(key)
+        if prepared is None:
+            if separator == "":
+                text = self.filename
+            else:
+                if separator not in self.parts:
+                    self.parts[separator] = self.filename.split(separator)
+                text = " ".join(self.parts[separator][-word_count:])
+            prepared = match_backend.prepare(text)
+            self.prepared[key] = prepared
+        return prepared
+
+
+def match_tracks(track_names, slskd_tracks):
+    """
+    Makes the same decisions as the original pairwise difflib checks, only faster.
+    Returns the summed best ratio of all tracks or None as soon as one track can't be matched.
+    """
+    folder = [FilenameVariants(slskd_track.filename) for slskd_track in slskd_tracks]
+    total_match = 0.0
+
+    for attempts in track_names:
+        best_match = 0.0
+        for variants in folder:
+            # The original checks only moved on to the next attempt while the ratio was below the minimum
+            # so the ratio that counts is the first one that reaches it
+            for separator, lidarr_filename, word_count in attempts:
+                ratio = match_backend.ratio(variants.get(separator, word_count), lidarr_filename, minimum_match_ratio)
+                if ratio >= minimum_match_ratio:
+                    if ratio > best_match:
+                        best_match = ratio
+                    break
+
+        if not best_match > minimum_match_ratio:
+            return None
+        total_match += best_match
 
-        return ratio
-    return ratio
+    return total_match
 
 
 def album_track_num(directory):
-    files = directory["files"]
+    files = directory.files
     allowed_filetypes_no_attributes = [item.split(" ")[0] for item in allowed_filetypes]
     count = 0
     index = -1
     filetype = ""
     for file in files:
-        if file["filename"].split(".")[-1] in allowed_filetypes_no_attributes:
-            new_index = allowed_filetypes_no_attributes.index(file["filename"].split(".")[-1])
+        if file.extension in allowed_filetypes_no_attributes:
+            new_index = allowed_filetypes_no_attributes.index(file.extension)
 
             if index == -1:
                 index = new_index
@@ -174,17 +860,37 @@ def sanitize_folder_name(folder_name):
     return valid_characters.strip()
 
 
+def delete_download_folders(files):
+    """
+    Removes the folders slskd saved the files into, finished files included.
+    """
+    for delete_dir in dict.fromkeys(file["file_dir"].split("\\")[-1] for file in files):
+        delete_path = os.path.join(slskd_download_dir, delete_dir)
+        if os.path.exists(delete_path):
+            shutil.rmtree(delete_path)
+
+
 def cancel_and_delete(files):
     for file in files:
         try:
             slskd.transfers.cancel_download(username=file["username"], id=file["id"])
         except Exception:
             logger.warning(f"Failed to cancel download {file['filename']} for {file['username']}", exc_info=True)
-        delete_dir = file["file_dir"].split("\\")[-1]
-        os.chdir(slskd_download_dir)
+    os.chdir(slskd_download_dir)
+    delete_download_folders(files)
 
-        if os.path.exists(delete_dir):
-            shutil.rmtree(delete_dir)
+
+def cancel_unfinished(files):
+    """
+    Cancels the transfers that haven't finished. Finished transfers are left in slskd as they are.
+    """
+    for file in files:
+        if file["status"] is not None and file["status"]["state"] == "Completed, Succeeded":
+            continue
+        try:
+            slskd.transfers.cancel_download(username=file["username"], id=file["id"])
+        except Exception:
+            logger.warning(f"Failed to cancel download {file['filename']} for {file['username']}", exc_info=True)
 
 
 def release_trackcount_mode(releases):
@@ -262,51 +968,53 @@ def choose_release(artist_name, releases):
     return default_release
 
 
-def verify_filetype(file, allowed_filetype):
-    current_filetype = file["filename"].split(".")[-1]
-    bitdepth = None
-    samplerate = None
-    bitrate = None
-
-    if "bitRate" in file:
-        bitrate = file["bitRate"]
-    if "sampleRate" in file:
-        samplerate = file["sampleRate"]
-    if "bitDepth" in file:
-        bitdepth = file["bitDepth"]
-
-    # Check if the types match up for the current files type and the current type from the config
-    if current_filetype == allowed_filetype.split(" ")[0]:
-        # Check if the current type from the config specifies other attributes than the filetype (bitrate etc)
-        if " " in allowed_filetype:
-            selected_attributes = allowed_filetype.split(" ")[1]
-            # If it is a bitdepth/samplerate pair instead of a simple bitrate
-            if "/" in selected_attributes:
-                selected_bitdepth = selected_attributes.split("/")[0]
-                try:
-                    selected_samplerate = str(int(float(selected_attributes.split("/")[1]) * 1000))
-                except (ValueError, IndexError):
-                    logger.warning("Invalid samplerate in selected_attributes")
-                    return False
-
-                if bitdepth and samplerate:
-                    if str(bitdepth) == str(selected_bitdepth) and str(samplerate) == str(selected_samplerate):
-                        return True
-                else:
-                    return False
-            # If it is a bitrate
-            else:
-                selected_bitrate = selected_attributes
-                if bitrate:
-                    if str(bitrate) == str(selected_bitrate):
-                        return True
-                else:
-                    return False
-        # If no bitrate or other info then it is a match so return true
-        else:
-            return True
-    else:
-        return False
+class FiletypeSpec:
+    """
+    One allowed_filetypes entry such as "flac", "mp3 320" or "flac 24/192", parsed once.
+    matches() makes the same decision verify_filetype used to make for a raw slskd search file.
+    """
+
+    __slots__ = ("name", "extension", "bitrate", "bitdepth", "samplerate", "valid")
+
+    def __init__(self, allowed_filetype):
+        self.name = allowed_filetype
+        self.extension, _, attributes = allowed_filetype.partition(" ")
+        self.bitrate = self.bitdepth = self.samplerate = None
+        self.valid = True
+        # If it is a bitdepth/samplerate pair instead of a simple bitrate
+        if "/" in attributes:
+            self.bitdepth, _, samplerate = attributes.partition("/")
+            try:
+                self.samplerate = str(int(float(samplerate) * 1000))
+            except ValueError:
+                logger.warning(f"Invalid samplerate in allowed filetype: {allowed_filetype}")
+                self.valid = False
+        elif attributes:
+            self.bitrate = attributes
+
+    def matches(self, file):
+        if not self.valid or file["filename"].split(".")[-1] != self.extension:
+            return False
+        if self.bitdepth is not None:
+            bitdepth = file.get("bitDepth")
+            samplerate = file.get("sampleRate")
+            return bool(bitdepth and samplerate) and str(bitdepth) == self.bitdepth and str(samplerate) == self.samplerate
+        if self.bitrate is not None:
+            bitrate = file.get("bitRate")
+            return bool(bitrate) and str(bitrate) == self.bitrate
+        # If no bitrate or other info then it is a match
+        return True
+
+
+def build_filetype_index(specs):
+    """
+    Maps each extension to its specs in allowed_filetypes order so a file only has to be checked
+    against the entries for its own extension.
+    """
+    index = {}
+    for spec in specs:
+        index.setdefault(spec.extension, []).append(spec)
+    return index
 
 
 def download_filter(allowed_filetype, directory):
@@ -320,110 +1028,231 @@ def download_filter(allowed_filetype, directory):
     if download_filtering:
         whitelist = []  # Init an empty list to take just the allowed_filetype
         if use_extension_whitelist:
-            whitelist = copy.deepcopy(extensions_whitelist)  # Copy the whitelist to allow us to append the allowed_filetype
+            whitelist = list(extensions_whitelist)  # Copy the whitelist to allow us to append the allowed_filetype
         whitelist.append(allowed_filetype.split(" ")[0])
-        unwanted = []
+        whitelist = {extension.lower() for extension in whitelist}
         logger.debug(f"Accepted extensions: {whitelist}")
-        for file in directory["files"]:
-            for extension in whitelist:
-                if file["filename"].split(".")[-1].lower() == extension.lower():
-                    break  # Jump out and don't add wanted files to the unwanted list
+        wanted = []
+        for file in directory.files:
+            if file.extension.lower() in whitelist:
+                logger.debug(f"Added file to queue: {file.filename}")
+                wanted.append(file)
             else:
-                unwanted.append(file["filename"])  # Add to list of files to remove from the wanted list
-                logger.debug(f"Unwanted file: {file['filename']}")
-        if len(unwanted) > 0:
-            temp = []
-            logger.debug(f"Unwanted Files: {unwanted}")
-            for file in directory["files"]:
-                if file["filename"] not in unwanted:
-                    logger.debug(f"Added file to queue: {file['filename']}")
-                    temp.append(file)  # Build the new list of files
-            directory["files"] = temp
-            for files in temp:
-                logger.debug(f"File in final list: {files['filename']}")
-            return directory  # Return the modified list
+                logger.debug(f"Unwanted file: {file.filename}")
+        if len(wanted) < len(directory.files):
+            return directory.with_files(wanted)  # Return a filtered view. The cached directory stays as it is
     return directory  # If we didn't find unwanted files or we aren't filtering just return the original list
 
 
+def fetch_directory(username, file_dir):
+    """
+    Browses a single folder of a user. Uses the on-disk directory cache when enabled.
+    Returns None if the user couldn't be browsed.
+    """
+    if directory_store is not None:
+        directory = directory_store.get(json.dumps([username, file_dir]), directory_cache_ttl)
+        if directory is not None:
+            logger.info(f"User: {username} Folder: {file_dir} in directory cache. Using cached value")
+            return SlskdDirectory.from_json(directory)
+
+    logger.info(f"User: {username} Folder: {file_dir} not in cache. Fetching from SLSKD")
+    version = slskd.application.version()
+    version_check = slskd_version_check(version)
+
+    if not version_check:
+        logger.info(f"Error checking slskd version number: {version}. Version check > 0.22.2: {version_check}. This would most likely be fixed by updating your slskd.")
+
+    start_time = clock.monotonic()
+    try:
+        if version_check:
+            directory = SlskdDirectory.from_json(slskd_browse.users.directory(username=username, directory=file_dir)[0])
+        else:
+            directory = SlskdDirectory.from_json(slskd_browse.users.directory(username=username, directory=file_dir))
+    except Exception as ex:
+        metrics.observe("browse_seconds", clock.monotonic() - start_time)
+        tracer.record("browse", None, clock.monotonic() - start_time, user=username, folder=file_dir, error=True)
+        if isinstance(ex, requests.Timeout):
+            metrics.inc("timeouts_total", kind="browse")
+            logger.info(f"User: {username} did not answer within {browse_timeout} seconds. Skipping them for this run")
+        else:
+            logger.exception(f'Error getting directory from user: "{username}"')
+        if browse_error_store is not None:
+            browse_error_store.set(username, {"directory": file_dir})
+        if peer_stats is not None:
+            peer_stats.record(username, browse_errors=1)
+        return None
+
+    metrics.observe("browse_seconds", clock.monotonic() - start_time)
+    tracer.record("browse", None, clock.monotonic() - start_time, user=username, folder=file_dir, files=len(directory.files))
+    if directory_store is not None:
+        directory_store.set(json.dumps([username, file_dir]), directory.to_json())
+    return directory
+
+
+def skip_user(username):
+    """
+    True if the user couldn't be browsed earlier in this run or, with browse_error_ttl set, in a recent run.
+    """
+    if username in broken_user:
+        return True
+    if browse_error_store is not None and browse_error_store.get(username, browse_error_ttl) is not None:
+        logger.info(f"Skipping user: {username} due to a recent browse error")
+        broken_user.append(username)
+        return True
+    stats = peer_stats.get(username) if peer_stats is not None else None
+    if peer_max_failures > 0 and stats and stats["failures"] + stats["browse_errors"] - stats["successes"] >= peer_max_failures:
+        logger.info(f"Skipping user: {username} due to {stats['failures']} failed downloads and {stats['browse_errors']} browse errors")
+        broken_user.append(username)
+        return True
+    return False
+
+
+def cache_directory(username, file_dir, directory):
+    if username not in folder_cache:
+        logger.debug(f"Add user to cache: {username}")
+        folder_cache[username] = {}
+        folder_cache_times[username] = clock.monotonic()
+    folder_cache[username][file_dir] = directory
+
+
+def directory_matches(tracks, allowed_filetype, directory, username):
+    tracks_info = album_track_num(directory)
+    if tracks_info["count"] == len(tracks) and tracks_info["filetype"] != "":
+        return album_match(tracks, directory.files, username, allowed_filetype)
+    return False
+
+
+def prefetch_directories(tracks, results, allowed_filetype):
+    """
+    Browses the folders of the best ranked users at the same time, up to browse_prefetch folders,
+    and puts them in folder_cache so check_for_match doesn't wait on them one by one.
+    Stops waiting once a folder matches and every better ranked folder is in. Browses that are still
+    running are left in browse_futures for check_for_match to pick up instead of asking again.
+    Each browse times out on its own after browse_timeout seconds.
+    """
+    candidates = []
+    for username in results:
+        if len(candidates) >= browse_prefetch:
+            break
+        if allowed_filetype not in results[username] or skip_user(username):
+            continue
+        for file_dir in results[username][allowed_filetype]:
+            if file_dir not in folder_cache.get(username, {}) and (username, file_dir) not in browse_futures:
+                candidates.append((username, file_dir))
+    candidates = candidates[:browse_prefetch]
+    if len(candidates) < 2:
+        return
+
+    logger.info(f"Browsing {len(candidates)} folders from {len({username for username, _ in candidates})} users")
+    executor = ThreadPoolExecutor(max_workers=len(candidates), thread_name_prefix="browse")
+    futures = {}
+    for rank, candidate in enumerate(candidates):
+        future = executor.submit(tracer.bind(fetch_directory), *candidate)
+        browse_futures[candidate] = future
+        futures[future] = rank
+    # Every worker already has its browse, and those requests time out by themselves, so nothing is left to wait for
+    executor.shutdown(wait=False)
+    pending = set(range(len(candidates)))
+    best_match = None
+    for future in as_completed(futures):
+        rank = futures[future]
+        pending.discard(rank)
+        username, file_dir = candidates[rank]
+        browse_futures.pop((username, file_dir), None)
+        directory = future.result()
+        if directory is None:
+            if username not in broken_user:
+                broken_user.append(username)
+            continue
+        cache_directory(username, file_dir, directory)
+        if (best_match is None or rank < best_match) and directory_matches(tracks, allowed_filetype, directory, username):
+            best_match = rank
+        if best_match is not None and all(other > best_match for other in pending):
+            if pending:
+                logger.info(f"Found a match from {username}. Not waiting on {len(pending)} slower folders")
+            break
+
+
 def check_for_match(tracks, allowed_filetype, file_dirs, username):
     """
     Does the actual match checking on a single disk/album.
     """
     logger.debug(f"Current broken users {broken_user}")
-    if username in broken_user:
+    if skip_user(username):
         return False, {}, ""
     for file_dir in file_dirs:
-        if username not in folder_cache:
-            logger.debug(f"Add user to cache: {username}")
-            folder_cache[username] = {}
-
-        if file_dir not in folder_cache[username]:
-            logger.info(f"User: {username} Folder: {file_dir} not in cache. Fetching from SLSKD")
-            version = slskd.application.version()
-            version_check = slskd_version_check(version)
-
-            if not version_check:
-                logger.info(f"Error checking slskd version number: {version}. Version check > 0.22.2: {version_check}. This would most likely be fixed by updating your slskd.")
-
-            try:
-                if version_check:
-                    directory = slskd.users.directory(username=username, directory=file_dir)[0]
-                else:
-                    directory = slskd.users.directory(username=username, directory=file_dir)
-            except Exception:
-                logger.exception(f'Error getting directory from user: "{username}"')
+        if file_dir not in folder_cache.get(username, {}):
+            future = browse_futures.pop((username, file_dir), None)
+            # A browse prefetch_directories stopped waiting on is still on its way, use its answer
+            directory = future.result() if future is not None else fetch_directory(username, file_dir)
+            if directory is None:
                 broken_user.append(username)
                 logger.debug(f"Updated broken users {broken_user}")
                 return False, {}, ""
-            folder_cache[username][file_dir] = copy.deepcopy(directory)
+            cache_directory(username, file_dir, directory)
         else:
             logger.info(f"User: {username} Folder: {file_dir} in cache. Using cached value")
-            directory = copy.deepcopy(folder_cache[username][file_dir])
-
-        track_num = len(tracks)
-        tracks_info = album_track_num(directory)
+            directory = folder_cache[username][file_dir]
 
-        if tracks_info["count"] == track_num and tracks_info["filetype"] != "":
-            if album_match(tracks, directory["files"], username, allowed_filetype):
-                return True, directory, file_dir
-            else:
-                continue
+        if directory_matches(tracks, allowed_filetype, directory, username):
+            return True, directory, file_dir
     return False, {}, ""
 
 
-def is_blacklisted(title: str) -> bool:
-    blacklist = config.get("Search Settings", "title_blacklist", fallback="").lower().split(",")
-    for word in blacklist:
-        if word != "" and word in title.lower():
-            logger.info(f"Skipping {title} due to blacklisted word: {word}")
-            return True
-    return False
-
-
-def filter_list(albums):
+class AlbumFilter:
     """
-    Helper to do all the various filtering in one go and in one place. Same net effect as the previous multi-stage approach
-    Just neater and easier to work on.
+    The title/search blacklists, ignored users and failed import denylist, built once per run.
+    Each blacklist is merged into one case-insensitive regex so a title or query is scanned once
+    no matter how many words are configured.
     """
-    temp_list = copy.deepcopy(albums)
 
-    if failed_import_denylist:
-        import_denylist = load_failed_import_denylist(failed_import_denylist_file_path)
-        filtered_temp = []
-        for album in temp_list:
-            if str(album["id"]) in import_denylist:
-                logger.info(f"Skipping failed import album: {album['artist']['artistName']} - {album['title']} (ID: {album['id']})")
-            else:
-                filtered_temp.append(album)
-        temp_list = filtered_temp
+    def __init__(self, title_blacklist=(), search_blacklist=(), ignored_users=(), denylist=()):
+        self.title_pattern = self.compile(title_blacklist)
+        self.search_pattern = self.compile(search_blacklist)
+        self.ignored_users = frozenset(ignored_users)
+        self.denylist = set(denylist)
 
-    list_to_download = []
-    for album in temp_list:
-        if is_blacklisted(album["title"]):
-            logger.info(f"Skipping blacklisted album: {album['artist']['artistName']} - {album['title']} (ID: {album['id']}")
-            continue
-        else:
+    @staticmethod
+    def compile(words):
+        words = [word for word in words if word]
+        if not words:
+            return None
+        # Longest first so the longest blacklisted word wins when several start at the same place
+        return re.compile("|".join(re.escape(word) for word in sorted(words, key=len, reverse=True)), re.IGNORECASE)
+
+    def blacklisted_word(self, title):
+        if self.title_pattern is None:
+            return None
+        found = self.title_pattern.search(title)
+        return found.group(0).lower() if found else None
+
+    def clean_query(self, query):
+        if self.search_pattern is not None:
+            query = self.search_pattern.sub("", query)
+        return " ".join(query.split())
+
+    def filter(self, albums):
+        """
+        Returns the albums that aren't on the denylist or blacklisted. The album dicts themselves are shared, not copied.
+        """
+        list_to_download = []
+        for album in albums:
+            if str(album["id"]) in self.denylist:
+                logger.info(f"Skipping failed import album: {album['artist']['artistName']} - {album['title']} (ID: {album['id']})")
+                continue
+            word = self.blacklisted_word(album["title"])
+            if word is not None:
+                logger.info(f"Skipping blacklisted album: {album['artist']['artistName']} - {album['title']} (ID: {album['id']}) due to blacklisted word: {word}")
+                continue
             list_to_download.append(album)
+        return list_to_download
+
+
+def filter_list(albums):
+    """
+    Helper to do all the various filtering in one go and in one place.
+    """
+    list_to_download = album_filter.filter(albums)
 
     if len(list_to_download) > 0:
         return list_to_download
@@ -431,6 +1260,90 @@ def filter_list(albums):
         return None
 
 
+def wait_for_search(search_id, search_timeout, early_match=None):
+    """
+    Waits for a slskd search to complete. The state is polled with exponential backoff
+    starting at SEARCH_POLL_INITIAL seconds. The search is stopped early once the response
+    count hasn't grown for search_settle_time seconds or early_match finds a folder that
+    already matches. search_timeout is in milliseconds, same as the value sent to slskd.
+    Returns False if the search had to be stopped at the deadline.
+    """
+    start_time = clock.monotonic()
+    deadline = start_time + search_timeout / 1000 + SEARCH_DEADLINE_GRACE
+    delay = SEARCH_POLL_INITIAL
+    response_count = 0
+    last_growth = start_time
+    polls = 0
+    while True:
+        state = slskd.searches.state(search_id, False)  # Added False here as we don't want the search results here. Just the state.
+        polls += 1
+        # The state is "Requested" or "InProgress" until slskd is done. Finished searches are "Completed, <reason>"
+        if state.get("isComplete") or state["state"].startswith("Completed"):
+            break
+
+        now = clock.monotonic()
+        if state.get("responseCount", 0) != response_count:
+            response_count = state["responseCount"]
+            last_growth = now
+            if early_match is not None and early_match(search_id):
+                logger.info("Found a matching folder in the search responses. Stopping search early")
+                slskd.searches.stop(search_id)
+                break
+        elif response_count > 0 and search_settle_time > 0 and now - last_growth >= search_settle_time:
+            logger.info(f"No new search responses for {search_settle_time}s. Stopping search early")
+            slskd.searches.stop(search_id)
+            break
+
+        if now >= deadline:
+            slskd.searches.stop(search_id)
+            return False
+        clock.sleep(min(delay, deadline - now))
+        delay = min(delay * 2, SEARCH_POLL_MAX)
+
+    logger.debug(f"Search finished after {clock.monotonic() - start_time:.1f}s and {polls} state checks")
+    return True
+
+
+def search_early_match(album):
+    """
+    Builds the early_match check for wait_for_search.
+    Groups the raw search responses by folder and runs album_match against the tracks of
+    the release we would pick. Only the most preferred filetype counts, otherwise an early
+    mp3 result could cut off a flac source that is still on its way.
+    """
+    spec = filetype_specs[0]
+    allowed_filetype = spec.name
+    try:
+        releases = lidarr_cache.get_album(album["id"])["releases"]
+        release = choose_release(album["artist"]["artistName"], releases)
+        tracks = lidarr_cache.get_tracks(album["artistId"], album["id"], release["id"])
+    except Exception:
+        logger.warning("Failed to get tracks for early search match. Waiting for the full search instead", exc_info=True)
+        return None
+    if len(tracks) == 0:
+        return None
+
+    def early_match(search_id):
+        try:
+            responses = slskd.searches.search_responses(search_id)
+        except Exception:
+            logger.debug("Failed to get search responses for early match", exc_info=True)
+            return False
+        for response in responses:
+            folders = {}
+            for file in response["files"]:
+                if not spec.matches(file):
+                    continue
+                file_dir, _, filename = file["filename"].rpartition("\\")
+                folders.setdefault(file_dir, []).append(SlskdFile(filename))
+            for files in folders.values():
+                if len(files) == len(tracks) and album_match(tracks, files, response["username"], allowed_filetype):
+                    return True
+        return False
+
+    return early_match
+
+
 def search_for_album(album):
     album_title = album["title"]
     artist_name = album["artist"]["artistName"]
@@ -441,23 +1354,32 @@ def search_for_album(album):
         query = artist_name + " " + album_title if config.getboolean("Search Settings", "album_prepend_artist", fallback=False) else album_title
 
     original_query = query
-    for word in search_blacklist:
-        if word:
-            # Case-insensitive replacement
-            pattern = re.compile(re.escape(word), re.IGNORECASE)
-            query = pattern.sub("", query)
-
-    # Clean up double spaces
-    query = " ".join(query.split())
+    query = album_filter.clean_query(query)
+    tracer.start_album(album_id, f"{artist_name} - {album_title}")
 
     if query != original_query:
         logger.info(f"Filtered search query: '{original_query}' -> '{query}'")
 
+    if search_result_store is not None:
+        cached = search_result_store.get(str(album_id), search_cache_ttl)
+        if cached is not None and cached["allowed_filetypes"] == allowed_filetypes:
+            logger.info(f"Using cached search results for album: {query} ({len(cached['users'])} users)")
+            search_cache[album_id] = cached["users"]
+            search_peers[album_id] = cached.get("peers", {})
+            search_cache_times[album_id] = clock.monotonic()
+            return True
+
+    if search_rate_limiter is not None:
+        search_rate_limiter.acquire()
+
+    search_timeout = config.getint("Search Settings", "search_timeout", fallback=5000)
     logger.info(f"Searching for album: {query}")
+    start_time = clock.monotonic()
+    metrics.inc("searches_total")
     try:
         search = slskd.searches.search_text(
             searchText=query,
-            searchTimeout=config.getint("Search Settings", "search_timeout", fallback=5000),
+            searchTimeout=search_timeout,
             filterResponses=True,
             maximumPeerQueueLength=config.getint("Search Settings", "maximum_peer_queue", fallback=50),
             minimumPeerUploadSpeed=config.getint("Search Settings", "minimum_peer_upload_speed", fallback=0),
@@ -466,18 +1388,14 @@ def search_for_album(album):
         logger.exception(f"Failed to perform search via SLSKD: {query}")
         return False
 
-    # Add timeout here to increase reliability with Slskd. Sometimes it doesn't update search status fast enough. More of an issue with lots of historical searches in slskd
-    time.sleep(5)
-    start_time = time.time()
-    while True:
-        if slskd.searches.state(search["id"], False)["state"] != "InProgress":  # Added False here as we don't want the search results here. Just the state.
-            break
-        time.sleep(1)
-        if (time.time() - start_time) > config.getint("Search Settings", "search_timeout", fallback=5000):
-            logger.error("Failed to perform search via SLSKD due to timeout on search results.")
-            return False
+    early_match = search_early_match(album) if early_match_exit else None
+    if not wait_for_search(search["id"], search_timeout, early_match):
+        logger.warning("Search did not finish before the deadline. Using the responses received so far.")
+        metrics.inc("timeouts_total", kind="search")
 
     search_results = slskd.searches.search_responses(search["id"])  # We use this API call twice. Let's just cache it locally.
+    metrics.observe("search_seconds", clock.monotonic() - start_time)
+    tracer.record("search", album_id, clock.monotonic() - start_time, query=query, results=len(search_results))
     logger.info(f"Search returned {len(search_results)} results")
     if delete_searches:
         slskd.searches.delete(search["id"])
@@ -487,23 +1405,30 @@ def search_for_album(album):
 
     if album_id not in search_cache:
         search_cache[album_id] = {}  # This is so we can check for matches we missed or if a user goes offline during our download
+    search_cache_times[album_id] = clock.monotonic()
 
+    peers = search_peers.setdefault(album_id, {})
     for result in search_results:  # Switching to cached version. One less API call
         username = result["username"]
+        peers[username] = {key: result.get(key) for key in ("uploadSpeed", "queueLength", "hasFreeUploadSlot")}
         if username not in search_cache[album_id]:
             # If we don't currently have a cache for a user set one up
             search_cache[album_id][username] = {}
         logger.info(f"Caching and truncating results for user: {username}")
-        init_files = result["files"]  # init_files short for initial files. Before truncating
+        # Folders per allowed filetype. Dicts keep them in the order found without duplicates
+        user_dirs = {filetype: dict.fromkeys(file_dirs) for filetype, file_dirs in search_cache[album_id][username].items()}
         # Search the returned files and only cache files that are of the allowed_filetypes
-        for file in init_files:
-            file_dir = file["filename"].rsplit("\\", 1)[0]  # split dir/filenames on \
-            for allowed_filetype in allowed_filetypes:
-                if verify_filetype(file, allowed_filetype):  # Check the filename for an allowed type
-                    if allowed_filetype not in search_cache[album_id][username]:
-                        search_cache[album_id][username][allowed_filetype] = []  # Init the cache for this allowed filetype
-                    if file_dir not in search_cache[album_id][username][allowed_filetype]:
-                        search_cache[album_id][username][allowed_filetype].append(file_dir)
+        for file in result["files"]:
+            filename = file["filename"]
+            for spec in filetype_index.get(filename.split(".")[-1], ()):
+                if spec.matches(file):
+                    file_dir = filename.rsplit("\\", 1)[0]  # split dir/filenames on \
+                    user_dirs.setdefault(spec.name, {})[file_dir] = None
+        for filetype, file_dirs in user_dirs.items():
+            search_cache[album_id][username][filetype] = list(file_dirs)
+
+    if search_result_store is not None:
+        search_result_store.set(str(album_id), {"allowed_filetypes": allowed_filetypes, "users": search_cache[album_id], "peers": peers})
     return True
 
 
@@ -513,13 +1438,14 @@ def slskd_do_enqueue(username, files, file_dir):
     It also adds to each file the details needed to track that specific file.
     """
     downloads = []
+    start_time = clock.monotonic()
     try:
         enqueue = slskd.transfers.enqueue(username=username, files=files)
     except Exception:
         logger.debug("Enqueue failed", exc_info=True)
         return None
     if enqueue:
-        time.sleep(5)
+        clock.sleep(5)
         try:
             download_list = slskd.transfers.get_downloads(username=username)
         except Exception:
@@ -537,17 +1463,41 @@ def slskd_do_enqueue(username, files, file_dir):
                             file_details["username"] = username
                             file_details["size"] = file["size"]
                             downloads.append(file_details)
+        tracer.record("enqueue", None, clock.monotonic() - start_time, user=username, files=len(downloads))
         return downloads
     else:
         return None
 
 
-def slskd_download_status(downloads):
+def get_transfer_index():
+    """
+    Gets every download in slskd with a single request and indexes the transfers by id.
+    Returns None if the request failed so callers fall back to checking file by file.
+    """
+    try:
+        all_downloads = slskd.transfers.get_all_downloads()
+    except Exception:
+        logger.warning("Failed to get the list of downloads from slskd", exc_info=True)
+        return None
+    transfers = {}
+    for user in all_downloads:
+        for directory in user["directories"]:
+            for transfer in directory["files"]:
+                transfers[transfer["id"]] = transfer
+    return transfers
+
+
+def slskd_download_status(downloads, transfers=None):
     """
     Takes a list of files and gets the status of each file and packs it into the file object.
+    The status is taken from transfers (see get_transfer_index) when given. Files that aren't
+    in it are looked up one at a time.
     """
     ok = True
     for file in downloads:
+        if transfers is not None and file["id"] in transfers:
+            file["status"] = transfers[file["id"]]
+            continue
         try:
             status = slskd.transfers.get_download(file["username"], file["id"])
             file["status"] = status
@@ -585,11 +1535,39 @@ def downloads_all_done(downloads):
     return all_done, error_list, remote_queue
 
 
+def peer_score(peer, stats=None):
+    """
+    Higher is better. Uses the free upload slot, upload speed and queue length slskd reported in the search response.
+    With peer stats the speed we actually measured replaces the reported one and the user's track record is added.
+    """
+    peer = peer or {}
+    score = peer_free_slot_weight if peer.get("hasFreeUploadSlot") else 0.0
+    speed = PeerStats.speed(stats)
+    score += peer_speed_weight * (speed if speed is not None else peer.get("uploadSpeed") or 0) / 1048576
+    score -= peer_queue_weight * (peer.get("queueLength") or 0)
+    score += peer_history_weight * PeerStats.reliability(stats)
+    return score
+
+
+def rank_results(album_id, results):
+    """
+    Returns the search results with the users in the order we should try them: best score first.
+    Users we already failed to browse this run go last. Ties keep the order slskd returned them in.
+    """
+    peers = search_peers.get(album_id, {})
+    scores = {username: peer_score(peers.get(username), peer_stats.get(username) if peer_stats is not None else None) for username in results}
+    ranked = sorted(results, key=lambda username: (username not in broken_user, scores[username]), reverse=True)
+    logger.debug(f"Peer ranking: {[(username, round(scores[username], 1)) for username in ranked[:5]]}")
+    return {username: results[username] for username in ranked}
+
+
 def try_enqueue(all_tracks, results, allowed_filetype):
     """
     Single album match and enqueue.
     Iterates over all users and enqueues a found match
     """
+    if browse_prefetch > 1:
+        prefetch_directories(all_tracks, results, allowed_filetype)
     for username in results:
         if allowed_filetype not in results[username]:
             continue
@@ -598,25 +1576,24 @@ def try_enqueue(all_tracks, results, allowed_filetype):
         found, directory, file_dir = check_for_match(all_tracks, allowed_filetype, file_dirs, username)
         if found:
             directory = download_filter(allowed_filetype, directory)
-            for i in range(0, len(directory["files"])):
-                directory["files"][i]["filename"] = file_dir + "\\" + directory["files"][i]["filename"]
+            files = [file.enqueue_entry(file_dir) for file in directory.files]
             try:
-                downloads = slskd_do_enqueue(username=username, files=directory["files"], file_dir=file_dir)
+                downloads = slskd_do_enqueue(username=username, files=files, file_dir=file_dir)
                 if downloads is not None:
                     return True, downloads
                 else:
-                    album = lidarr.get_album(all_tracks[0]["albumId"])
+                    album = lidarr_cache.get_album(all_tracks[0]["albumId"])
                     album_name = album["title"]
                     artist_name = album["artist"]["artistName"]
                     logger.info(f"Failed to enqueue download to slskd for {artist_name} - {album_name} from {username}")
             except Exception as e:
-                album = lidarr.get_album(all_tracks[0]["albumId"])
+                album = lidarr_cache.get_album(all_tracks[0]["albumId"])
                 album_name = album["title"]
                 artist_name = album["artist"]["artistName"]
 
                 logger.warning(f"Exception enqueueing tracks: {e}")
                 logger.info(f"Exception enqueueing download to slskd for {artist_name} - {album_name} from {username}")
-    album = lidarr.get_album(all_tracks[0]["albumId"])
+    album = lidarr_cache.get_album(all_tracks[0]["albumId"])
     album_name = album["title"]
     artist_name = album["artist"]["artistName"]
     logger.info(f"Failed to enqueue {artist_name} - {album_name}")
@@ -630,7 +1607,6 @@ def try_multi_enqueue(release, all_tracks, results, allowed_filetype):
     Otherwise it's basically the same as the single album search.
     """
     split_release = []
-    tmp_results = copy.deepcopy(results)
     for media in release["media"]:
         disk = {}
         disk["source"] = None
@@ -644,8 +1620,8 @@ def try_multi_enqueue(release, all_tracks, results, allowed_filetype):
     total = len(split_release)
     count_found = 0
     for disk in split_release:
-        for username in tmp_results:
-            if allowed_filetype not in tmp_results[username]:
+        for username in results:
+            if allowed_filetype not in results[username]:
                 continue
             file_dirs = results[username][allowed_filetype]
             found, directory, file_dir = check_for_match(disk["tracks"], allowed_filetype, file_dirs, username)
@@ -664,10 +1640,9 @@ def try_multi_enqueue(release, all_tracks, results, allowed_filetype):
         enqueued = 0
         for disk in split_release:
             username, directory, file_dir = disk["source"]
-            for i in range(0, len(directory["files"])):
-                directory["files"][i]["filename"] = file_dir + "\\" + directory["files"][i]["filename"]
+            files = [file.enqueue_entry(file_dir) for file in directory.files]
             try:
-                downloads = slskd_do_enqueue(username=username, files=directory["files"], file_dir=file_dir)
+                downloads = slskd_do_enqueue(username=username, files=files, file_dir=file_dir)
                 if downloads is not None:
                     for file in downloads:
                         file["disk_no"] = disk["disk_no"]
@@ -675,7 +1650,7 @@ def try_multi_enqueue(release, all_tracks, results, allowed_filetype):
                     all_downloads.extend(downloads)
                     enqueued += 1
                 else:
-                    album = lidarr.get_album(all_tracks[0]["albumId"])
+                    album = lidarr_cache.get_album(all_tracks[0]["albumId"])
                     album_name = album["title"]
                     artist_name = album["artist"]["artistName"]
                     logger.info(f"Failed to enqueue download to slskd for {artist_name} - {album_name} from {username}")
@@ -684,7 +1659,7 @@ def try_multi_enqueue(release, all_tracks, results, allowed_filetype):
                         cancel_and_delete(all_downloads)
                         return False, None
             except Exception:
-                album = lidarr.get_album(all_tracks[0]["albumId"])
+                album = lidarr_cache.get_album(all_tracks[0]["albumId"])
                 album_name = album["title"]
                 artist_name = album["artist"]["artistName"]
 
@@ -706,72 +1681,152 @@ def try_multi_enqueue(release, all_tracks, results, allowed_filetype):
         return False, None
 
 
-def find_download(album, grab_list):
+def find_download(album, grab_list, exclude_users=()):
     """
     This does the main loop over search results and user directories
     It has two paths it can take. One is the "single album" path
     The other is the multi-media path.
+    Users in exclude_users are not considered.
+    Holds match_lock, the searches and the failover worker can both be matching at the same time.
     """
     album_id = album["id"]
     artist_name = album["artist"]["artistName"]
     artist_id = album["artistId"]
-    results = search_cache[album_id]
-    for allowed_filetype in allowed_filetypes:
-        logger.info(f"Checking for Quality: {allowed_filetype}")
-        releases = lidarr.get_album(album_id)["releases"]
-        num_releases = len(releases)
-        for _ in range(0, num_releases):
-            if len(releases) == 0:
-                break
-            release = choose_release(artist_name, releases)
-            releases.remove(release)
-            release_id = release["id"]
-            all_tracks = lidarr.get_tracks(artistId=artist_id, albumId=album_id, albumReleaseId=release_id)
-            found, downloads = try_enqueue(all_tracks, results, allowed_filetype)
+    with match_lock, tracer.span("match", album_id) as span:
+        results = rank_results(album_id, {username: dirs for username, dirs in search_cache[album_id].items() if username not in exclude_users})
+        for allowed_filetype in allowed_filetypes:
+            logger.info(f"Checking for Quality: {allowed_filetype}")
+            releases = list(lidarr_cache.get_album(album_id)["releases"])
+            num_releases = len(releases)
+            for _ in range(0, num_releases):
+                if len(releases) == 0:
+                    break
+                release = choose_release(artist_name, releases)
+                releases.remove(release)
+                release_id = release["id"]
+                all_tracks = lidarr_cache.get_tracks(artist_id, album_id, release_id)
+                found, downloads = try_enqueue(all_tracks, results, allowed_filetype)
+                if not found and len(release["media"]) > 1:
+                    found, downloads = try_multi_enqueue(release, all_tracks, results, allowed_filetype)
 
-            if found:
-                grab_list[album_id] = {}
-                grab_list[album_id]["files"] = downloads
-                grab_list[album_id]["filetype"] = allowed_filetype
-                grab_list[album_id]["title"] = album["title"]
-                grab_list[album_id]["artist"] = artist_name
-                grab_list[album_id]["year"] = album["releaseDate"][0:4]
-                return True
-            elif len(release["media"]) > 1:
-                found, downloads = try_multi_enqueue(release, all_tracks, results, allowed_filetype)
                 if found:
-                    grab_list[album_id] = {}
-                    grab_list[album_id]["files"] = downloads
-                    grab_list[album_id]["filetype"] = allowed_filetype
-                    grab_list[album_id]["title"] = album["title"]
-                    grab_list[album_id]["artist"] = artist_name
-                    grab_list[album_id]["year"] = album["releaseDate"][0:4]
+                    # Built before it goes into grab_list. The monitor may already be watching grab_list from another thread
+                    grab_list[album_id] = {
+                        "files": downloads,
+                        "filetype": allowed_filetype,
+                        "title": album["title"],
+                        "artist": artist_name,
+                        "year": album["releaseDate"][0:4],
+                        "enqueued_at": clock.time(),
+                    }
+                    metrics.inc("matches_total")
+                    span.update(found=True, user=downloads[0]["username"], filetype=allowed_filetype)
                     return True
+        span["found"] = False
     return False
 
 
-def search_and_queue(albums):
-    grab_list = {}
-    failed_grab = []
-    failed_search = []
-    for i, album in enumerate(albums):
-        search_start = time.time()
-        if search_for_album(album):
+def search_and_queue(albums, grab_list=None, failed_search=None, failed_grab=None):
+    """
+    Searches for every album and enqueues the best match found.
+    With parallel_searches > 1 the searches run on a worker pool and matching/enqueueing
+    happens on this thread as each search finishes.
+    The results go into the given grab_list/failed lists so they can be shared with monitor_downloads.
+    """
+    grab_list = {} if grab_list is None else grab_list
+    failed_search = [] if failed_search is None else failed_search
+    failed_grab = [] if failed_grab is None else failed_grab
+
+    def handle_search(album, searched):
+        if searched:
             if not find_download(album, grab_list):
+                tracer.end_album(album["id"], status="no_match")
                 failed_grab.append(album)
         else:
+            tracer.end_album(album["id"], status="not_found")
             failed_search.append(album)
 
-        if minimum_search_interval > 0 and i < len(albums) - 1:
-            elapsed = time.time() - search_start
-            remaining = minimum_search_interval - elapsed
-            if remaining > 0:
-                logger.info(f"Search completed in {elapsed:.1f}s, waiting {remaining:.1f}s to meet minimum_search_interval")
-                time.sleep(remaining)
+    if parallel_searches > 1 and len(albums) > 1:
+        logger.info(f"Running up to {parallel_searches} searches in parallel")
+        executor = ThreadPoolExecutor(max_workers=parallel_searches, thread_name_prefix="search")
+        try:
+            futures = {executor.submit(search_for_album, album): album for album in albums}
+            for future in as_completed(futures):
+                album = futures[future]
+                try:
+                    searched = future.result()
+                except Exception:
+                    logger.exception(f"Search failed for Album: {album['title']} - Artist: {album['artist']['artistName']}")
+                    searched = False
+                handle_search(album, searched)
+        finally:
+            # Don't start the remaining searches if we are shutting down
+            executor.shutdown(wait=True, cancel_futures=True)
+    else:
+        for album in albums:
+            handle_search(album, search_for_album(album))
 
     return grab_list, failed_search, failed_grab
 
 
+def tag_file(file, album_data):
+    """
+    Sets the album, album artist and disc tags of one file that is ready for import.
+    Files that already have the right tags aren't rewritten. Returns True if the file was saved.
+    """
+    try:
+        song = music_tag.load_file(file["import_path"])
+    except NotImplementedError:
+        return False  # Not a supported audio file (e.g. jpg, nfo)
+    except Exception:
+        logger.exception(f"Error loading file for tagging: {file['import_path']}")
+        return False
+    tags = {}
+    if "disk_no" in file:
+        tags["discnumber"] = file["disk_no"]
+        tags["totaldiscs"] = file["disk_count"]
+    tags["albumartist"] = album_data["artist"]
+    tags["album"] = album_data["title"]
+    try:
+        changed = [key for key, value in tags.items() if song[key].value != value]
+        if not changed:
+            return False
+        for key in changed:
+            song[key] = tags[key]
+        song.save()
+        return True
+    except Exception:
+        logger.exception(f"Error writing tags for: {file['import_path']}")
+        return False
+
+
+def tag_album(album_data):
+    """
+    Tags every file of a completed album on a pool of tagging_workers threads.
+    """
+    start_time = clock.monotonic()
+    with ThreadPoolExecutor(max_workers=tagging_workers, thread_name_prefix="tag") as executor:
+        saved = sum(executor.map(lambda file: tag_file(file, album_data), album_data["files"]))
+    elapsed = clock.monotonic() - start_time
+    logger.info(f"Tagged {album_data['artist']} - {album_data['title']} in {elapsed:.1f}s. Updated {saved} of {len(album_data['files'])} files")
+    return elapsed
+
+
+def replaying():
+    return cassette is not None and cassette.mode == "replay"
+
+
+def create_replay_files(files):
+    """
+    Nothing is downloaded during a replay. Creates an empty file where slskd would have saved each
+    file so the move and import steps run in the sandbox like they did during the recording.
+    """
+    for file in files:
+        folder = os.path.join(slskd_download_dir, file["file_dir"].split("\\")[-1])
+        os.makedirs(folder, exist_ok=True)
+        open(os.path.join(folder, file["filename"].split("\\")[-1]), "a").close()
+
+
 def process_completed_album(album_data, failed_grab):
     os.chdir(slskd_download_dir)
     if rename_download_folders is True:
@@ -785,6 +1840,7 @@ def process_completed_album(album_data, failed_grab):
     moved_files_history = []
     if not os.path.exists(import_folder_fullpath):
         os.mkdir(import_folder_fullpath)
+    start_time = clock.monotonic()
     for file in album_data["files"]:
         file_folder = file["file_dir"].split("\\")[-1]
         filename = file["filename"].split("\\")[-1]
@@ -812,9 +1868,11 @@ def process_completed_album(album_data, failed_grab):
                 os.rmdir(import_folder_fullpath)
             except OSError:
                 logger.warning(f"Could not remove temp import directory {import_folder_fullpath}")
-            failed_grab.append(lidarr.get_album(album_data["album_id"]))
+            tracer.record("move", album_data["album_id"], clock.monotonic() - start_time, files=len(album_data["files"]), error=True)
+            failed_grab.append(lidarr_cache.get_album(album_data["album_id"]))
             return
     else:  # Only runs if all files are successfully moved
+        tracer.record("move", album_data["album_id"], clock.monotonic() - start_time, files=len(album_data["files"]))
         for rm_dir in rm_dirs:
             if not rm_dir == import_folder_fullpath:
                 try:
@@ -825,41 +1883,41 @@ def process_completed_album(album_data, failed_grab):
             logger.info(f"Sync disabled. Skipping Lidarr import of {album_data['artist']} - {album_data['title']}")
             return
         logger.info(f"Attempting Lidarr import of {album_data['artist']} - {album_data['title']}")
-        for file in album_data["files"]:
-            try:
-                song = music_tag.load_file(file["import_path"])
-            except NotImplementedError:
-                continue  # Not a supported audio file (e.g. jpg, nfo)
-            except Exception:
-                logger.exception(f"Error loading file for tagging: {file['import_path']}")
-                continue
-            try:
-                if "disk_no" in file:
-                    song["discnumber"] = file["disk_no"]
-                    song["totaldiscs"] = file["disk_count"]
-                song["albumartist"] = album_data["artist"]
-                song["album"] = album_data["title"]
-                song.save()
-            except Exception:
-                logger.exception(f"Error writing tags for: {file['import_path']}")
+        if replaying():
+            logger.info("Replay: not tagging the empty stand-in files")
+        else:
+            with tracer.span("tag", album_data["album_id"]):
+                tag_album(album_data)
+        start_time = clock.monotonic()
         command = lidarr.post_command(
             name="DownloadedAlbumsScan",
             path=album_data["import_folder"],
         )  # Album all tagged up and in a correctly named folder. This should work more reliably
         logger.info(f"Starting Lidarr import for: {album_data['title']} ID: {command['id']}")
 
+        deadline = start_time + import_timeout
         while True:
             current_task = lidarr.get_command(command["id"])
             if current_task["status"] == "completed" or current_task["status"] == "failed":
                 break
-            time.sleep(2)
+            if clock.monotonic() >= deadline:
+                metrics.inc("timeouts_total", kind="import")
+                tracer.record("lidarr_command", album_data["album_id"], clock.monotonic() - start_time, error="timeout")
+                logger.warning(f"Lidarr import of {album_data['artist']} - {album_data['title']} did not finish within {import_timeout}s. No longer waiting for it.")
+                failed_grab.append(lidarr_cache.get_album(album_data["album_id"]))
+                return
+            clock.sleep(2)
+        metrics.observe("import_seconds", clock.monotonic() - start_time)
+        tracer.record("lidarr_command", album_data["album_id"], clock.monotonic() - start_time, status=current_task["status"], message=current_task.get("message"))
+        lidarr_cache.invalidate(album_data["album_id"])  # The import changes the album in Lidarr
 
         try:
             logger.info(f"{current_task['commandName']} {current_task['message']} from: {current_task['body']['path']}")
 
             if "Failed" in current_task["message"]:
+                metrics.inc("failed_imports_total")
                 folder_path = move_failed_import(current_task["body"]["path"])
-                failed_grab.append(lidarr.get_album(album_data["album_id"]))
+                failed_grab.append(lidarr_cache.get_album(album_data["album_id"]))
                 if failed_import_denylist:
                     add_to_failed_import_denylist(
                         failed_import_denylist_file_path,
@@ -873,24 +1931,193 @@ def process_completed_album(album_data, failed_grab):
             logger.error(current_task)
 
 
-def monitor_downloads(grab_list, failed_grab):
+class ImportQueue:
+    """
+    Runs process_completed_album on its own worker threads so a slow move, tag or Lidarr
+    import never pauses monitor_downloads. Albums that failed to import are handed back
+    to the monitor through collect().
+    """
+
+    def __init__(self, workers):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="import")
+        self.pending = set()
+
+    def submit(self, album_data):
+        self.pending.add(self.executor.submit(self._process, album_data))
+
+    def _process(self, album_data):
+        failed_grab = []
+        try:
+            process_completed_album(album_data, failed_grab)
+        except Exception:
+            logger.exception(f"Import failed for Album: {album_data['title']} Artist: {album_data['artist']}")
+            failed_grab.append(lidarr_cache.get_album(album_data["album_id"]))
+        if failed_grab:
+            tracer.end_album(album_data["album_id"], status="import_failed")
+        else:
+            tracer.end_album(album_data["album_id"], status="downloaded" if lidarr_disable_sync else "imported")
+        return failed_grab
+
+    def collect(self, failed_grab):
+        """
+        Adds the failures of every finished import to failed_grab. Returns the number of imports still running.
+        """
+        for future in [future for future in self.pending if future.done()]:
+            self.pending.remove(future)
+            failed_grab.extend(future.result())
+        return len(self.pending)
+
+    def shutdown(self, failed_grab):
+        self.executor.shutdown(wait=True)
+        self.collect(failed_grab)
+
+
+class FailoverQueue:
+    """
+    Looks for a new source for stalled albums on its own thread so the browses and enqueueing
+    never pause monitor_downloads. New sources, and albums nobody else has, are handed back to
+    the monitor through collect().
+    """
+
+    def __init__(self):
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="failover")
+        self.pending = set()
+
+    def submit(self, album_id, album_data, tried):
+        self.pending.add(self.executor.submit(self._find, album_id, album_data, tried))
+
+    def _find(self, album_id, album_data, tried):
+        album = lidarr_cache.get_album(album_id)
+        new_source = {}
+        try:
+            found = album_id in search_cache and find_download(album, new_source, exclude_users=tried)
+        except Exception:
+            logger.exception(f"Failed to find another source for Album: {album_data['title']} Artist: {album_data['artist']}")
+            found = False
+        if not found:
+            logger.info(f"No other source for Album: {album_data['title']} Artist: {album_data['artist']}")
+            tracer.end_album(album_id, status="download_failed")
+            return album_id, None, album
+        new_source[album_id]["tried_users"] = sorted(tried)
+        new_source[album_id]["enqueued_at"] = album_data["enqueued_at"]
+        logger.info(f"Album: {album_data['title']} now downloading from {new_source[album_id]['files'][0]['username']}")
+        return album_id, new_source[album_id], album
+
+    def collect(self, grab_list, failed_grab):
+        """
+        Puts every album that got a new source back into grab_list and the others in failed_grab.
+        Returns the number of albums still looking for a source.
+        """
+        for future in [future for future in self.pending if future.done()]:
+            self.pending.remove(future)
+            album_id, album_data, album = future.result()
+            if album_data is not None:
+                grab_list[album_id] = album_data
+            else:
+                failed_grab.append(album)
+        return len(self.pending)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+
+
+def monitor_downloads(grab_list, failed_grab, search_done=None):
+    """
+    Watches grab_list until every album is imported or has failed.
+    When search_done is given, searches are still adding to grab_list from another
+    thread and we keep going until it is set.
+    Completed albums are imported in the background by an ImportQueue.
+    """
     MAX_FILE_RETRIES = 4  # Max requeue attempts per file for hard errors (Errored, Cancelled, etc.)
+    import_queue = ImportQueue(import_workers)
+    failover_queue = FailoverQueue()
+
+    def record_peers(album_data, **counts):
+        if peer_stats is not None:
+            for username in {file["username"] for file in album_data["files"]}:
+                peer_stats.record(username, **counts)
+
+    def record_success(album_data):
+        if peer_stats is None:
+            return
+        now = clock.time()
+        first_byte_at = album_data.get("first_byte_at", album_data["count_start"])
+        for username in {file["username"] for file in album_data["files"]}:
+            peer_stats.record(
+                username,
+                successes=1,
+                bytes=sum(file["size"] for file in album_data["files"] if file["username"] == username),
+                seconds=now - first_byte_at,
+                first_byte_seconds=first_byte_at - album_data["count_start"],
+            )
 
-    def delete_album(reason):
+    def delete_album(reason, **counts):
+        record_peers(grab_list[album_id], failures=1, **counts)
+        tracer.record("download", album_id, clock.time() - grab_list[album_id]["enqueued_at"], user=grab_list[album_id]["files"][0]["username"], error=reason)
+        tracer.end_album(album_id, status="download_failed")
         cancel_and_delete(grab_list[album_id]["files"])
         logger.info(f"{reason} Album: {grab_list[album_id]['title']} Artist: {grab_list[album_id]['artist']}")
         del grab_list[album_id]
-        failed_grab.append(lidarr.get_album(album_id))
+        failed_grab.append(lidarr_cache.get_album(album_id))
+
+    def failover(album_id):
+        """
+        Drops a stalled album's current source and hands it to the failover worker, which looks for
+        the best matching user we haven't tried yet in the cached search results.
+        """
+        album_data = grab_list.pop(album_id)
+        tried = set(album_data.get("tried_users", ())) | {file["username"] for file in album_data["files"]}
+        logger.info(f"No progress for {failover_grace} seconds on Album: {album_data['title']} Artist: {album_data['artist']}. Trying the next best source")
+        record_peers(album_data, failures=1)
+        tracer.record("download", album_id, clock.time() - album_data["enqueued_at"], user=album_data["files"][0]["username"], error="stalled")
+        cancel_unfinished(album_data["files"])
+        # Files the old source did finish would otherwise end up in the import of a new source whose folder has the same name
+        delete_download_folders(album_data["files"])
+        failover_queue.submit(album_id, album_data, tried)
+
+    def note_progress(album_data):
+        """
+        Remembers when the album first received data and when one of its unfinished files last
+        received more. Finished files don't count, they can't make progress anymore. A requeued file
+        is a new transfer, so it is compared against its own bytes and not the ones of the old transfer.
+        """
+        now = clock.time()
+        album_data.setdefault("progress_at", now)
+        for file in album_data["files"]:
+            if file["status"] is None:
+                continue
+            transferred = file["status"].get("bytesTransferred", 0)
+            if transferred > 0 and "first_byte_at" not in album_data:
+                album_data["first_byte_at"] = now
+            if file["status"]["state"].startswith("Completed"):
+                continue
+            if file.get("progress") is None or file["progress"][0] != file["id"] or transferred > file["progress"][1]:
+                file["progress"] = (file["id"], transferred)
+                album_data["progress_at"] = now
+
+    def stalled(album_data):
+        """
+        True once none of the unfinished files has received any bytes for failover_grace seconds.
+        """
+        return clock.time() - album_data["progress_at"] >= failover_grace
 
     def requeue_file(album_id, file):
         """Requeue a single errored file. Returns True on success, False if enqueue failed."""
         data_dict = [{"filename": file["filename"], "size": file["size"]}]
         logger.info(f"Download error. Requeue file: {file['filename']}")
-        requeue = slskd_do_enqueue(file["username"], data_dict, file["file_dir"])
+        metrics.inc("requeues_total")
+        if peer_stats is not None and file["status"] is not None:
+            if file["status"]["state"] == "Completed, Rejected":
+                peer_stats.record(file["username"], rejected=1)
+            elif file["status"]["state"] == "Completed, TimedOut":
+                peer_stats.record(file["username"], timed_out=1)
+        with tracer.span("requeue", album_id, user=file["username"], file=file["filename"].rsplit("\\", 1)[-1]) as span:
+            requeue = slskd_do_enqueue(file["username"], data_dict, file["file_dir"])
+            span["queued"] = requeue is not None
         if requeue is not None:
             file["id"] = requeue[0]["id"]
-            time.sleep(1)
-            slskd_download_status(grab_list[album_id]["files"])
+            clock.sleep(1)
+            slskd_download_status(grab_list[album_id]["files"], get_transfer_index())
             return True
         return False
 
@@ -939,29 +2166,38 @@ def monitor_downloads(grab_list, failed_grab):
         return True  # Requeued one file; wait for next monitoring iteration
 
     while True:
+        transfers = get_transfer_index() if grab_list else None  # One request per iteration no matter how many files we are watching
         for album_id in list(grab_list.keys()):
-            if not slskd_download_status(grab_list[album_id]["files"]):
+            if not slskd_download_status(grab_list[album_id]["files"], transfers):
                 grab_list[album_id]["error_count"] = grab_list[album_id].get("error_count", 0) + 1
                 continue
 
             album_done, problems, queued = downloads_all_done(grab_list[album_id]["files"])
 
-            grab_list[album_id].setdefault("count_start", time.time())
-            elapsed = time.time() - grab_list[album_id]["count_start"]
+            grab_list[album_id].setdefault("count_start", clock.time())
+            elapsed = clock.time() - grab_list[album_id]["count_start"]
+            note_progress(grab_list[album_id])
 
             if elapsed >= stalled_timeout:
+                metrics.inc("timeouts_total", kind="download")
                 delete_album("Timeout waiting for download of")
                 continue
             if queued == len(grab_list[album_id]["files"]) and elapsed >= remote_queue_timeout:
-                delete_album("Timeout waiting for download of")
+                metrics.inc("timeouts_total", kind="remote_queue")
+                delete_album("Timeout waiting for download of", remote_queued=1)
                 continue
 
             if album_done:
                 album_data = grab_list[album_id]
                 album_data["album_id"] = album_id
                 logger.info(f"Completed download of Album: {album_data['title']} Artist: {album_data['artist']}")
-                process_completed_album(album_data, failed_grab)
+                if replaying():
+                    create_replay_files(album_data["files"])
+                record_success(album_data)
+                metrics.observe("download_seconds", clock.time() - album_data["enqueued_at"])
+                tracer.record("download", album_id, clock.time() - album_data["enqueued_at"], user=album_data["files"][0]["username"])
                 del grab_list[album_id]
+                import_queue.submit(album_data)
                 continue
 
             if problems:
@@ -980,10 +2216,26 @@ def monitor_downloads(grab_list, failed_grab):
                     else:
                         logger.error(f"Unexpected file state in problem list: {state}")
 
-        if not grab_list:
+            # Errored and rejected files got their requeue above, which counts as progress for the new
+            # transfers. Only look for another source if nothing is moving after that either
+            if album_id in grab_list and failover_grace > 0:
+                note_progress(grab_list[album_id])
+                if stalled(grab_list[album_id]):
+                    failover(album_id)
+
+        metrics.set("grab_list_albums", len(grab_list))
+        # Read search_done first. Once it is set nothing else gets added to grab_list
+        searching = search_done is not None and not search_done.is_set()
+        importing = import_queue.collect(failed_grab)
+        failing_over = failover_queue.collect(grab_list, failed_grab)
+        if not grab_list and not searching and not importing and not failing_over:
             break
 
-        time.sleep(5)
+        save_metrics()
+        clock.sleep(5)
+
+    failover_queue.shutdown()
+    import_queue.shutdown(failed_grab)
 
 
 def grab_most_wanted(albums):
@@ -996,22 +2248,51 @@ def grab_most_wanted(albums):
     After that has happened for all the downloads it then shifts to monitoring the downloads:
     Monitor download and perform retries and/or requeues.
     When all completed, call lidarr to import
+    With pipeline_downloads the searching runs in the background and monitoring starts right away.
     """
 
-    grab_list, failed_search, failed_grab = search_and_queue(albums)
+    # Only warms the cache, so with metadata_cache_ttl = 0 it would be a wasted request per batch
+    if lidarr_cache.ttl > 0:
+        try:
+            lidarr_cache.get_albums([album["id"] for album in albums])
+        except Exception:
+            logger.warning("Failed to prefetch albums from Lidarr. They will be fetched one at a time", exc_info=True)
+
+    if pipeline_downloads:
+        grab_list = {}
+        failed_search = []
+        failed_grab = []
+        search_done = threading.Event()
 
-    total_albums = len(grab_list)
-    logger.info(f"Total Downloads added: {total_albums}")
-    for album_id in grab_list:
-        logger.info(f"Album: {grab_list[album_id]['title']} Artist: {grab_list[album_id]['artist']}")
-    logger.info(f"Failed to grab: {len(failed_grab)}")
-    for album in failed_grab:
-        logger.info(f"Album: {album['title']} Artist: {album['artist']['artistName']}")
+        def search_worker():
+            try:
+                search_and_queue(albums, grab_list, failed_search, failed_grab)
+            except Exception:
+                logger.exception("Searching failed. Waiting for the downloads that were already added")
+            finally:
+                search_done.set()
+
+        search_thread = threading.Thread(target=search_worker, name="search", daemon=True)
+        search_thread.start()
+        logger.info(f"Monitoring downloads while searching... monitor at: {''.join([slskd_host_url, slskd_url_base, 'downloads'])}")
+        monitor_downloads(grab_list, failed_grab, search_done)
+        search_thread.join()
+    else:
+        grab_list, failed_search, failed_grab = search_and_queue(albums)
 
-    logger.info("-------------------")
-    logger.info(f"Waiting for downloads... monitor at: {''.join([slskd_host_url, slskd_url_base, 'downloads'])}")
+        total_albums = len(grab_list)
+        logger.info(f"Total Downloads added: {total_albums}")
+        for album_id in grab_list:
+            logger.info(f"Album: {grab_list[album_id]['title']} Artist: {grab_list[album_id]['artist']}")
+        logger.info(f"Failed to grab: {len(failed_grab)}")
+        for album in failed_grab:
+            logger.info(f"Album: {album['title']} Artist: {album['artist']['artistName']}")
+
+        logger.info("-------------------")
+        logger.info(f"Waiting for downloads... monitor at: {''.join([slskd_host_url, slskd_url_base, 'downloads'])}")
 
-    monitor_downloads(grab_list, failed_grab)
+        monitor_downloads(grab_list, failed_grab)
+    logger.debug(f"Lidarr metadata cache: {lidarr_cache.hits} hits, {lidarr_cache.misses} misses")
 
     count = len(failed_search) + len(failed_grab)
     for album in failed_search:
@@ -1105,6 +2386,73 @@ def update_current_page(path: str, page: str) -> None:
         file.write(page)
 
 
+def page_count(first_page):
+    if not first_page["pageSize"]:
+        return 1
+    return math.ceil(first_page["totalRecords"] / first_page["pageSize"])
+
+
+def fetch_pages(fetch_page, pages):
+    """
+    Fetches the given page numbers of a paged Lidarr resource with up to lidarr_page_workers
+    requests in flight. Returns {page number: records}. Pages that failed are logged and left out.
+    """
+    records = {}
+    pages = list(pages)
+    if not pages:
+        return records
+    with ThreadPoolExecutor(max_workers=lidarr_page_workers, thread_name_prefix="lidarr") as executor:
+        futures = {executor.submit(fetch_page, page): page for page in pages}
+        for future in as_completed(futures):
+            try:
+                records[futures[future]] = future.result()["records"]
+            except Exception as ex:
+                logger.error(f"Failed to grab page {futures[future]}: {ex}")
+    return records
+
+
+def get_all_wanted(missing, first_page):
+    """
+    Gets every wanted record for search_type = all.
+    With wanted_sync_ttl set, the pages are kept in a local index. As long as the total and the
+    first page are the same as last time nothing has shifted, so only expired pages are downloaded again.
+    """
+    source = "missing" if missing else "cutoff_unmet"
+    pages = range(2, page_count(first_page) + 1)
+    fingerprint = {
+        "total": first_page["totalRecords"],
+        "page_size": page_size,
+        "first_page": [record["id"] for record in first_page["records"]],
+    }
+    cached = {}
+    if wanted_store is not None:
+        previous = wanted_store.get(source)
+        if previous == fingerprint:
+            for page in pages:
+                entry = wanted_store.get(f"{source}:{page}", wanted_sync_ttl)
+                # Each page carries the fingerprint it was fetched under so a page that failed to
+                # download after the list shifted can't bring back records from the old list
+                if isinstance(entry, dict) and entry.get("fingerprint") == fingerprint:
+                    cached[page] = entry["records"]
+        else:
+            if previous is not None:
+                for page in range(2, page_count({"totalRecords": previous["total"], "pageSize": previous["page_size"]}) + 1):
+                    wanted_store.delete(f"{source}:{page}")
+            wanted_store.set(source, fingerprint)
+
+    fetched = fetch_pages(
+        lambda page: lidarr.get_wanted(page=page, page_size=page_size, sort_dir="ascending", sort_key="albums.title", missing=missing),
+        [page for page in pages if page not in cached],
+    )
+    if wanted_store is not None:
+        for page, records in fetched.items():
+            wanted_store.set(f"{source}:{page}", {"fingerprint": fingerprint, "records": records})
+        logger.info(f"Wanted list ({source}): reused {len(cached)} and downloaded {len(fetched) + 1} of {len(pages) + 1} pages")
+
+    all_pages = {1: first_page["records"], **cached, **fetched}
+    return [record for page in sorted(all_pages) for record in all_pages[page]]
+
+
 def get_records(missing: bool) -> list:
     try:
         wanted = lidarr.get_wanted(
@@ -1121,25 +2469,13 @@ def get_records(missing: bool) -> list:
 
     wanted_records = []
     if search_type == "all":
-        page = 1
-        while len(wanted_records) < total_wanted:
-            try:
-                wanted = lidarr.get_wanted(
-                    page=page,
-                    page_size=page_size,
-                    sort_dir="ascending",
-                    sort_key="albums.title",
-                    missing=missing,
-                )
-            except ConnectionError as ex:
-                logger.error(f"Failed to grab record: {ex}")
-            wanted_records.extend(wanted["records"])
-            page += 1
+        wanted_records = get_all_wanted(missing, wanted)
 
     elif search_type == "incrementing_page":
         page = get_current_page(current_page_file_path)
         try:
-            wanted_records = lidarr.get_wanted(
+            # Page 1 is the one we already have
+            wanted_records = wanted["records"] if page == 1 else lidarr.get_wanted(
                 page=page,
                 page_size=page_size,
                 sort_dir="ascending",
@@ -1155,32 +2491,21 @@ def get_records(missing: bool) -> list:
         wanted_records = wanted["records"]
 
     else:
-        if os.path.exists(lock_file_path) and not is_docker():
-            os.remove(lock_file_path)
-
         raise ValueError(f"[Search Settings] - {search_type = } is not valid")
 
     try:
-        queued_records = lidarr.get_queue(sort_dir="ascending", sort_key="albums.title")
-        total_queued = queued_records["totalRecords"]
-        current_queue = queued_records["records"]
-
-        if queued_records["pageSize"] < total_queued:
-            page = 2
-            while len(current_queue) < total_queued:
-                try:
-                    next_page = lidarr.get_queue(page=page, sort_key="albums.title", sort_dir="ascending")
-                except ConnectionError as ex:
-                    logger.error(f"Failed to get queue details: {ex}")
-                    break
-                current_queue.extend(next_page["records"])
-                page += 1
+        queued_records = lidarr.get_queue(page_size=QUEUE_PAGE_SIZE, sort_dir="ascending", sort_key="albums.title")
+        queue_pages = fetch_pages(
+            lambda page: lidarr.get_queue(page=page, page_size=QUEUE_PAGE_SIZE, sort_key="albums.title", sort_dir="ascending"),
+            range(2, page_count(queued_records) + 1),
+        )
+        current_queue = queued_records["records"] + [record for page in sorted(queue_pages) for record in queue_pages[page]]
 
-        queued_album_ids = []
+        queued_album_ids = set()
 
         for record in current_queue:
             if "albumId" in record:
-                queued_album_ids.append(record["albumId"])
+                queued_album_ids.add(record["albumId"])
             else:
                 logger.warning(f"Dropping entry due to missing key in keylist: [{record.keys()}]")
 
@@ -1216,16 +2541,20 @@ def load_failed_import_denylist(file_path):
 
 def save_failed_import_denylist(file_path, denylist):
     try:
-        with open(file_path, "w") as file:
+        # Written next to the real file and swapped in so a crash never leaves half a denylist
+        with open(file_path + ".tmp", "w") as file:
             json.dump(denylist, file, indent=2)
+        os.replace(file_path + ".tmp", file_path)
     except IOError as ex:
         logger.error(f"Error saving failed import denylist: {ex}")
 
 
 def add_to_failed_import_denylist(file_path, album_id, artist, title, folder_path=None):
-    denylist = load_failed_import_denylist(file_path)
     album_key = str(album_id)
-    if album_key not in denylist:
+    with failed_import_denylist_lock:
+        denylist = load_failed_import_denylist(file_path)
+        if album_key in denylist:
+            return
         denylist[album_key] = {
             "album_id": album_id,
             "artist": artist,
@@ -1234,15 +2563,36 @@ def add_to_failed_import_denylist(file_path, album_id, artist, title, folder_pat
             "folder_path": folder_path,
         }
         save_failed_import_denylist(file_path, denylist)
-        logger.info(f"Added to failed import denylist: {artist} - {title} (ID: {album_id})")
+        if album_filter is not None:
+            album_filter.denylist.add(album_key)
+    logger.info(f"Added to failed import denylist: {artist} - {title} (ID: {album_id})")
 
 
-def main():
+def read_config():
+    """
+    Reads config.ini. Returns None if it doesn't exist.
+    """
+    if not os.path.exists(config_file_path):
+        return None
+    # Disable interpolation to make storing logging formats in the config file much easier
+    new_config = configparser.ConfigParser(interpolation=EnvInterpolation())
+    new_config.read(config_file_path)
+    return new_config
+
+
+def apply_config(var_dir):
+    """
+    Loads every setting from config into the module globals and sets up the API clients and caches.
+    Called once per run, and at the start of every cycle in daemon mode so config changes are picked up.
+    """
     global \
         slskd_api_key, \
         lidarr_api_key, \
         lidarr_download_dir, \
         lidarr_disable_sync, \
+        import_workers, \
+        import_timeout, \
+        tagging_workers, \
         slskd_download_dir, \
         lidarr_host_url, \
         slskd_host_url, \
@@ -1250,19 +2600,38 @@ def main():
         remote_queue_timeout, \
         delete_searches, \
         slskd_url_base, \
-        ignored_users, \
         search_type, \
         search_source, \
         download_filtering, \
         use_extension_whitelist, \
         extensions_whitelist, \
         rename_download_folders, \
+        pipeline_downloads, \
+        failover_grace, \
         search_sources, \
         minimum_match_ratio, \
+        peer_free_slot_weight, \
+        browse_prefetch, \
+        peer_history_weight, \
+        peer_max_failures, \
+        browse_timeout, \
+        peer_speed_weight, \
+        peer_queue_weight, \
         minimum_search_interval, \
+        parallel_searches, \
+        search_settle_time, \
+        early_match_exit, \
+        search_cache_ttl, \
+        directory_cache_ttl, \
+        directory_cache_size, \
+        browse_error_ttl, \
+        wanted_sync_ttl, \
+        lidarr_page_workers, \
+        match_backend, \
+        metrics, \
+        tracer, \
         page_size, \
         failed_import_denylist, \
-        failed_import_denylist_file_path, \
         use_selected_lidarr_release, \
         use_most_common_tracknum, \
         allow_multi_disc, \
@@ -1270,17 +2639,469 @@ def main():
         skip_region_check, \
         accepted_formats, \
         allowed_filetypes, \
-        lock_file_path, \
-        config_file_path, \
-        current_page_file_path, \
-        search_blacklist, \
+        filetype_specs, \
+        filetype_index, \
+        album_filter, \
         lidarr, \
+        lidarr_cache, \
         slskd, \
-        config, \
-        logger, \
-        search_cache, \
-        folder_cache, \
-        broken_user
+        slskd_browse, \
+        search_rate_limiter, \
+        search_result_store, \
+        directory_store, \
+        browse_error_store, \
+        wanted_store, \
+        peer_stats
+
+    slskd_api_key = config["Slskd"]["api_key"]
+    lidarr_api_key = config["Lidarr"]["api_key"]
+
+    lidarr_download_dir = config["Lidarr"]["download_dir"]
+    lidarr_disable_sync = config.getboolean("Lidarr", "disable_sync", fallback=False)
+    import_workers = max(1, config.getint("Lidarr", "import_workers", fallback=1))
+    import_timeout = config.getint("Lidarr", "import_timeout", fallback=600)
+    tagging_workers = max(1, config.getint("Lidarr", "tagging_workers", fallback=4))
+
+    slskd_download_dir = config["Slskd"]["download_dir"]
+
+    lidarr_host_url = config["Lidarr"]["host_url"]
+    slskd_host_url = config["Slskd"]["host_url"]
+
+    stalled_timeout = config.getint("Slskd", "stalled_timeout", fallback=3600)
+    remote_queue_timeout = config.getint("Slskd", "remote_queue_timeout", fallback=300)
+
+    delete_searches = config.getboolean("Slskd", "delete_searches", fallback=True)
+
+    slskd_url_base = config.get("Slskd", "url_base", fallback="/")
+
+    search_type = config.get("Search Settings", "search_type", fallback="first_page").lower().strip()
+    search_source = config.get("Search Settings", "search_source", fallback="missing").lower().strip()
+
+    download_filtering = config.getboolean("Download Settings", "download_filtering", fallback=False)
+    use_extension_whitelist = config.getboolean("Download Settings", "use_extension_whitelist", fallback=False)
+    extensions_whitelist = config.get("Download Settings", "extensions_whitelist", fallback="txt,nfo,jpg").split(",")
+    rename_download_folders = config.getboolean("Download Settings", "rename_download_folders", fallback=True)
+    pipeline_downloads = config.getboolean("Download Settings", "pipeline_downloads", fallback=False)
+    failover_grace = config.getint("Download Settings", "failover_grace", fallback=0)
+
+    search_sources = [search_source]
+    if search_sources[0] == "all":
+        search_sources = ["missing", "cutoff_unmet"]
+
+    minimum_match_ratio = config.getfloat("Search Settings", "minimum_filename_match_ratio", fallback=0.5)
+    browse_prefetch = config.getint("Search Settings", "browse_prefetch", fallback=1)
+    browse_timeout = config.getint("Search Settings", "browse_timeout", fallback=30)
+    peer_free_slot_weight = config.getfloat("Search Settings", "peer_free_slot_weight", fallback=50)
+    peer_speed_weight = config.getfloat("Search Settings", "peer_speed_weight", fallback=10)
+    peer_queue_weight = config.getfloat("Search Settings", "peer_queue_weight", fallback=1)
+    peer_history_weight = config.getfloat("Search Settings", "peer_history_weight", fallback=20)
+    peer_max_failures = config.getint("Search Settings", "peer_max_failures", fallback=0)
+    peer_stats_ttl = config.getint("Search Settings", "peer_stats_ttl", fallback=0)
+    minimum_search_interval = config.getint("Search Settings", "minimum_search_interval", fallback=5)
+    parallel_searches = max(1, config.getint("Search Settings", "parallel_searches", fallback=1))
+    search_settle_time = config.getfloat("Search Settings", "search_settle_time", fallback=0)
+    early_match_exit = config.getboolean("Search Settings", "early_match_exit", fallback=False)
+    search_cache_ttl = config.getint("Search Settings", "search_cache_ttl", fallback=0)
+    directory_cache_ttl = config.getint("Search Settings", "directory_cache_ttl", fallback=0)
+    directory_cache_size = config.getint("Search Settings", "directory_cache_size", fallback=10000)
+    browse_error_ttl = config.getint("Search Settings", "browse_error_ttl", fallback=0)
+    wanted_sync_ttl = config.getint("Search Settings", "wanted_sync_ttl", fallback=0)
+    lidarr_page_workers = max(1, config.getint("Search Settings", "lidarr_page_workers", fallback=4))
+    page_size = config.getint("Search Settings", "number_of_albums_to_grab", fallback=10)
+    failed_import_denylist = config.getboolean("Search Settings", "failed_import_denylist", fallback=True)
+
+    use_selected_lidarr_release = config.getboolean("Release Settings", "use_selected_lidarr_release", fallback=False)
+    use_most_common_tracknum = config.getboolean("Release Settings", "use_most_common_tracknum", fallback=True)
+    allow_multi_disc = config.getboolean("Release Settings", "allow_multi_disc", fallback=True)
+
+    default_accepted_countries = "Europe,Japan,United Kingdom,United States,[Worldwide],Australia,Canada"
+    default_accepted_formats = "CD,Digital Media,Vinyl"
+    accepted_countries = config.get("Release Settings", "accepted_countries", fallback=default_accepted_countries).split(",")
+    skip_region_check = config.getboolean("Release Settings", "skip_region_check", fallback=False)
+    accepted_formats = config.get("Release Settings", "accepted_formats", fallback=default_accepted_formats).split(",")
+
+    raw_filetypes = config.get("Search Settings", "allowed_filetypes", fallback="flac,mp3")
+
+    if "," in raw_filetypes:
+        allowed_filetypes = raw_filetypes.split(",")
+    else:
+        allowed_filetypes = [raw_filetypes]
+    filetype_specs = [FiletypeSpec(allowed_filetype) for allowed_filetype in allowed_filetypes]
+    filetype_index = build_filetype_index(filetype_specs)
+
+    search_blacklist = config.get("Search Settings", "search_blacklist", fallback="").split(",")
+    album_filter = AlbumFilter(
+        title_blacklist=config.get("Search Settings", "title_blacklist", fallback="").split(","),
+        search_blacklist=[word.strip() for word in search_blacklist],
+        ignored_users=config.get("Search Settings", "ignored_users", fallback="").split(","),
+        denylist=load_failed_import_denylist(failed_import_denylist_file_path) if failed_import_denylist else (),
+    )
+    search_rate_limiter = TokenBucket(minimum_search_interval)
+    for store in (search_result_store, directory_store, browse_error_store, wanted_store, peer_stats and peer_stats.store):
+        if store is not None:
+            store.close()
+    search_result_store = directory_store = browse_error_store = wanted_store = peer_stats = None
+    if search_cache_ttl > 0:
+        # Keeps search results between runs so recently searched albums don't hit the Soulseek network again
+        search_result_store = SqliteStore(os.path.join(var_dir, "soularr_cache.db"), "search_results")
+        search_result_store.prune(ttl=search_cache_ttl)
+    if directory_cache_ttl > 0:
+        # Folder listings browsed from other users. Saves browsing the same folders on the same peers every run
+        directory_store = SqliteStore(os.path.join(var_dir, "soularr_cache.db"), "directories")
+        directory_store.prune(ttl=directory_cache_ttl, max_entries=directory_cache_size)
+    if browse_error_ttl > 0:
+        # Users whose folders couldn't be browsed. They are skipped until the entry expires
+        browse_error_store = SqliteStore(os.path.join(var_dir, "soularr_cache.db"), "browse_errors")
+        browse_error_store.prune(ttl=browse_error_ttl)
+    if wanted_sync_ttl > 0:
+        # Pages of the wanted list for search_type = all
+        wanted_store = SqliteStore(os.path.join(var_dir, "soularr_cache.db"), "wanted_pages")
+        wanted_store.prune(ttl=wanted_sync_ttl)
+    if peer_stats_ttl > 0:
+        # Download results per user. Users we haven't dealt with for peer_stats_ttl seconds start over
+        peer_stats_store = SqliteStore(os.path.join(var_dir, "soularr_cache.db"), "peer_stats")
+        peer_stats_store.prune(ttl=peer_stats_ttl)
+        peer_stats = PeerStats(peer_stats_store)
+    match_backend = get_match_backend(config.get("Search Settings", "match_backend", fallback="difflib"))
+    logger.info(f"Using {match_backend.name} for filename matching")
+    if metrics is None:
+        metrics = Metrics()
+    if config.getboolean("Metrics", "enabled", fallback=False):
+        metrics.open(os.path.join(var_dir, config.get("Metrics", "metrics_file", fallback="soularr_metrics.prom")))
+    else:
+        metrics.open(None)
+    if tracer is None:
+        tracer = Tracer()
+    if config.getboolean("Metrics", "trace", fallback=False):
+        tracer.open(os.path.join(var_dir, config.get("Metrics", "trace_file", fallback="soularr_trace.jsonl")))
+    else:
+        tracer.open(None)
+
+    # The clients and the Lidarr cache are kept between daemon cycles unless the connection settings changed
+    slskd_settings = (slskd_host_url, slskd_api_key, slskd_url_base)
+    if slskd is None or slskd_settings != client_settings.get("slskd"):
+        slskd = slskd_api.SlskdClient(host=slskd_host_url, api_key=slskd_api_key, url_base=slskd_url_base)
+        client_settings["slskd"] = slskd_settings
+    browse_settings = slskd_settings + (browse_timeout,)
+    if slskd_browse is None or browse_settings != client_settings.get("slskd_browse"):
+        slskd_browse = slskd_api.SlskdClient(host=slskd_host_url, api_key=slskd_api_key, url_base=slskd_url_base, timeout=browse_timeout or None)
+        client_settings["slskd_browse"] = browse_settings
+    lidarr_settings = (lidarr_host_url, lidarr_api_key)
+    if lidarr is None or lidarr_settings != client_settings.get("lidarr"):
+        lidarr = LidarrAPI(lidarr_host_url, lidarr_api_key)
+        lidarr_cache = LidarrCache(lidarr, 0)
+        client_settings["lidarr"] = lidarr_settings
+    lidarr_cache.ttl = config.getint("Lidarr", "metadata_cache_ttl", fallback=3600)
+    if cassette is not None:
+        cassette.mount(slskd.searches.session, "slskd")
+        cassette.mount(slskd_browse.users.session, "slskd")
+        cassette.mount(lidarr.session, "lidarr")
+    if replaying():
+        # Moves, deletes and failed imports of a replay happen in the sandbox, not in the real download dir
+        slskd_download_dir = os.path.join(var_dir, "downloads")
+        os.makedirs(slskd_download_dir, exist_ok=True)
+
+
+def run_cycle():
+    """
+    One full run: gets the wanted records from Lidarr then searches, downloads and imports them.
+    Returns False if the run was stopped by an error.
+    """
+    start_time = clock.monotonic()
+    try:
+        wanted_records = []
+        try:
+            for source in search_sources:
+                logging.debug(f"Getting records from {source}")
+                missing = source == "missing"
+                wanted_records.extend(get_records(missing))
+        except ValueError as ex:
+            logger.error(f"An error occurred: {ex}")
+            return False
+
+        if len(wanted_records) > 0:
+            try:
+                filtered = filter_list(wanted_records)
+                if filtered is not None:
+                    failed = grab_most_wanted(filtered)
+                else:
+                    failed = 0
+                    logger.info("No releases wanted that aren't on the deny list and/or blacklisted")
+            except Exception:
+                logger.exception("Fatal error!")
+                return False
+            if failed == 0:
+                logger.info("Soularr finished.")
+                slskd.transfers.remove_completed_downloads()
+            else:
+                logger.info(f"{failed}: releases failed to find a match in the search results and are still wanted.")
+                slskd.transfers.remove_completed_downloads()
+        else:
+            logger.info("No releases wanted.")
+        return True
+    finally:
+        if directory_store is not None:
+            # Folders browsed during the run are only checked against directory_cache_size here,
+            # apply_config doesn't run again until the next cycle
+            directory_store.prune(ttl=directory_cache_ttl, max_entries=directory_cache_size)
+        metrics.observe("cycle_seconds", clock.monotonic() - start_time)
+        save_metrics(force=True)
+        tracer.finish()
+
+
+def save_metrics(force=False):
+    """
+    Updates the cache size gauges and writes the metrics file.
+    """
+    metrics.set("cache_entries", len(search_cache), cache="search_results")
+    metrics.set("cache_entries", sum(len(folders) for folders in folder_cache.values()), cache="folders")
+    metrics.set("cache_entries", len(lidarr_cache.albums), cache="lidarr_albums")
+    metrics.set("cache_entries", len(lidarr_cache.tracks), cache="lidarr_tracks")
+    metrics.save(force)
+
+
+def evict_runtime_caches(max_age):
+    """
+    Between daemon cycles: drops in-memory search results and folder listings older than
+    max_age seconds and gives broken users another chance.
+    """
+    now = clock.monotonic()
+    for album_id in [album_id for album_id, added in search_cache_times.items() if now - added >= max_age]:
+        search_cache.pop(album_id, None)
+        search_peers.pop(album_id, None)
+        del search_cache_times[album_id]
+    for username in [username for username, added in folder_cache_times.items() if now - added >= max_age]:
+        folder_cache.pop(username, None)
+        del folder_cache_times[username]
+    broken_user.clear()
+    browse_futures.clear()
+    logger.debug(f"Runtime caches: {len(search_cache)} albums, {len(folder_cache)} users")
+
+
+def run_daemon(var_dir, interval):
+    """
+    Runs a cycle every interval seconds in this process, keeping clients and caches warm in between.
+    Config changes are picked up at the start of each cycle. Stops on SIGTERM.
+    """
+    global config
+
+    applied = None  # The last config apply_config accepted
+    while True:
+        cycle_start = clock.monotonic()
+        new_config = read_config()
+        if new_config is None:
+            logger.error(f"Config file {config_file_path} is gone. Keeping the previous settings.")
+        else:
+            try:
+                config = new_config
+                apply_config(var_dir)
+                applied = new_config
+            except Exception:
+                logger.exception(f"Failed to apply {config_file_path}. Keeping the previous settings.")
+                # apply_config may have stopped halfway, so put every setting back the way it was
+                config = applied
+                if applied is not None:
+                    apply_config(var_dir)
+
+        if applied is None:
+            logger.error("No valid config yet. Trying again next cycle.")
+        else:
+            try:
+                if not run_cycle():
+                    logger.error("Run stopped by an error. Trying again next cycle.")
+            except Exception:
+                logger.exception("Run failed. Trying again next cycle.")
+
+            evict_runtime_caches(config.getint("Search Settings", "memory_cache_ttl", fallback=3600))
+        wait = max(0, interval - (clock.monotonic() - cycle_start))
+        logger.info(f"Waiting for {wait:.0f} seconds before the next run...")
+        clock.sleep(wait)
+
+
+def handle_sigterm(signum, frame):
+    logger.info("Received SIGTERM. Shutting down...")
+    raise SystemExit(0)
+
+
+class Cassette:
+    """
+    slskd and Lidarr API traffic saved to a gzipped JSONL file, one request per line.
+    Only the path, the JSON body and the response are kept. Headers (and with them the API keys) are not.
+    """
+
+    VERSION = 1
+
+    def __init__(self, path, mode):
+        self.path = path
+        self.mode = mode
+        self.lock = threading.Lock()
+        self.start_time = clock.monotonic()
+        self.responses = {}
+        if mode == "record":
+            self.file = gzip.open(path, "wt", encoding="utf-8")
+            self.file.write(json.dumps({"version": self.VERSION, "recorded": datetime.now().isoformat()}) + "\n")
+        else:
+            self.file = None
+            self.load()
+
+    @staticmethod
+    def key(service, request):
+        """
+        What a request is matched on during replay. The id slskd_api generates for every new
+        search is dropped, slskd hands back the recorded one and Soularr keeps using that.
+        """
+        body = request.body
+        if body:
+            try:
+                body = json.loads(body)
+            except ValueError:
+                body = body.decode("utf-8", "replace") if isinstance(body, bytes) else body
+            else:
+                if service == "slskd" and request.method == "POST" and request.path_url.endswith("/searches") and isinstance(body, dict):
+                    body.pop("id", None)
+                body = json.dumps(body, sort_keys=True)
+        return f"{service} {request.method} {request.path_url} {body or ''}"
+
+    def load(self):
+        entries = 0
+        with gzip.open(self.path, "rt", encoding="utf-8") as file:
+            try:
+                header = json.loads(file.readline())
+                if header.get("version") != self.VERSION:
+                    raise ValueError(f"Unsupported cassette version {header.get('version')} in {self.path}")
+                for line in file:
+                    entry = json.loads(line)
+                    self.responses.setdefault(entry["key"], []).append(entry)
+                    entries += 1
+            except EOFError:
+                # Soularr was killed while recording. Everything up to that point is still usable
+                logger.warning(f"Cassette {self.path} is truncated. Replaying the {entries} requests before the cut")
+        logger.info(f"Loaded {entries} recorded requests from {self.path}")
+
+    def write(self, key, response=None, error=None, elapsed=0.0):
+        entry = {"key": key, "at": round(clock.monotonic() - self.start_time, 3), "elapsed": round(elapsed, 3)}
+        if error is not None:
+            entry["error"] = f"{type(error).__name__}: {error}"
+        else:
+            entry.update(status=response.status_code, reason=response.reason, content_type=response.headers.get("Content-Type"), body=response.text)
+        with self.lock:
+            self.file.write(json.dumps(entry) + "\n")
+
+    def next_response(self, key):
+        """
+        Returns the next recorded response for the request. Polled endpoints (search state, transfers)
+        are asked more or less often than during the recording, so the last response repeats once the
+        recorded ones run out.
+        """
+        with self.lock:
+            entries = self.responses.get(key)
+            if not entries:
+                return None
+            return entries.pop(0) if len(entries) > 1 else entries[0]
+
+    def mount(self, session, service):
+        for prefix in ("http://", "https://"):
+            adapter = session.adapters.get(prefix)
+            if isinstance(adapter, (RecordingAdapter, ReplayAdapter)) and adapter.cassette is self:
+                continue
+            if self.mode == "record":
+                session.mount(prefix, RecordingAdapter(self, service, adapter))
+            else:
+                session.mount(prefix, ReplayAdapter(self, service))
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+class RecordingAdapter(requests.adapters.BaseAdapter):
+    """
+    Sends requests through the session's own adapter and writes them and their responses to the cassette.
+    """
+
+    def __init__(self, cassette, service, adapter):
+        super().__init__()
+        self.cassette = cassette
+        self.service = service
+        self.adapter = adapter
+
+    def send(self, request, **kwargs):
+        key = Cassette.key(self.service, request)
+        start = clock.monotonic()
+        try:
+            response = self.adapter.send(request, **kwargs)
+        except requests.RequestException as ex:
+            self.cassette.write(key, error=ex, elapsed=clock.monotonic() - start)
+            raise
+        self.cassette.write(key, response, elapsed=clock.monotonic() - start)
+        return response
+
+    def close(self):
+        self.adapter.close()
+
+
+class ReplayAdapter(requests.adapters.BaseAdapter):
+    """
+    Answers requests from the cassette instead of the network. Requests that were never recorded get a 404.
+    """
+
+    def __init__(self, cassette, service):
+        super().__init__()
+        self.cassette = cassette
+        self.service = service
+
+    def send(self, request, **kwargs):
+        key = Cassette.key(self.service, request)
+        entry = self.cassette.next_response(key)
+        if entry is not None:
+            # The recorded latency, shortened like every other wait by --replay-speed
+            clock.sleep(entry["elapsed"])
+            if "error" in entry:
+                raise requests.ConnectionError(f"Recorded error: {entry['error']}", request=request)
+        else:
+            logger.warning(f"No recorded response for {key[:200]}")
+        response = requests.Response()
+        response.request = request
+        response.url = request.url
+        response.status_code = entry["status"] if entry else 404
+        response.reason = entry["reason"] if entry else "Not Recorded"
+        response.encoding = "utf-8"
+        response._content = (entry["body"] if entry else "").encode("utf-8")
+        if entry and entry["content_type"]:
+            response.headers["Content-Type"] = entry["content_type"]
+        return response
+
+    def close(self):
+        pass
+
+
+class ScaledClock:
+    """
+    Used as clock during a replay so a run goes speed times faster. Sleeps are shortened and
+    time() and monotonic() run speed times faster, so timeouts and polling intervals still line
+    up with what was recorded. With scale_time=False only the sleeps are shortened, which is what
+    the end-to-end benchmark wants since its fake services keep real time.
+    """
+
+    def __init__(self, speed, scale_time=True):
+        self.speed = speed
+        self.time_speed = speed if scale_time else 1
+        self.start_time = time.time()
+        self.start_monotonic = time.monotonic()
+
+    def time(self):
+        return self.start_time + (time.time() - self.start_time) * self.time_speed
+
+    def monotonic(self):
+        return self.start_monotonic + (time.monotonic() - self.start_monotonic) * self.time_speed
+
+    def sleep(self, seconds):
+        time.sleep(seconds / self.speed)
+
+
+def main():
+    global lock_file_path, config_file_path, current_page_file_path, failed_import_denylist_file_path, config, cassette, clock
 
     # Let's allow some overrides to be passed to the script
     parser = argparse.ArgumentParser(description="""Soularr reads all of your "wanted" albums/artists from Lidarr and downloads them using Slskd""")
@@ -1318,6 +3139,38 @@ def main():
         help="Disable lock file creation",
     )
 
+    parser.add_argument(
+        "--daemon",
+        action="store_true",
+        help="Keep running and start a new run every --interval seconds instead of exiting",
+    )
+
+    parser.add_argument(
+        "--interval",
+        type=int,
+        default=int(os.getenv("SCRIPT_INTERVAL", "300")),
+        help="Seconds between the start of two runs in daemon mode (default: %(default)s)",
+    )
+
+    parser.add_argument(
+        "--record",
+        metavar="CASSETTE",
+        help="Save every slskd and Lidarr request and response of the run to this file (gzipped JSONL)",
+    )
+
+    parser.add_argument(
+        "--replay",
+        metavar="CASSETTE",
+        help="Run one cycle against a file saved with --record instead of slskd and Lidarr",
+    )
+
+    parser.add_argument(
+        "--replay-speed",
+        type=float,
+        default=20.0,
+        help="How many times faster than recorded a --replay runs. 1 keeps the recorded timing (default: %(default)s)",
+    )
+
     args = parser.parse_args()
 
     lock_file_path = os.path.join(args.var_dir, ".soularr.lock")
@@ -1329,16 +3182,17 @@ def main():
         logger.info(f"Soularr instance is already running.")
         sys.exit(1)
 
+    # Raise SystemExit so the finally below still cleans up the lock file
+    signal.signal(signal.SIGTERM, handle_sigterm)
+
     try:
         if not is_docker() and args.lock_file:
             with open(lock_file_path, "w") as lock_file:
                 lock_file.write("locked")
 
-        # Disable interpolation to make storing logging formats in the config file much easier
-        config = configparser.ConfigParser(interpolation=EnvInterpolation())
+        config = read_config()
 
-        if os.path.exists(config_file_path):
-            config.read(config_file_path)
+        if config is not None:
             setup_logging(config, args.var_dir)
         else:
             if is_docker():
@@ -1355,103 +3209,39 @@ def main():
                 os.remove(lock_file_path)
             sys.exit(0)
 
-        slskd_api_key = config["Slskd"]["api_key"]
-        lidarr_api_key = config["Lidarr"]["api_key"]
-
-        lidarr_download_dir = config["Lidarr"]["download_dir"]
-        lidarr_disable_sync = config.getboolean("Lidarr", "disable_sync", fallback=False)
-
-        slskd_download_dir = config["Slskd"]["download_dir"]
-
-        lidarr_host_url = config["Lidarr"]["host_url"]
-        slskd_host_url = config["Slskd"]["host_url"]
-
-        stalled_timeout = config.getint("Slskd", "stalled_timeout", fallback=3600)
-        remote_queue_timeout = config.getint("Slskd", "remote_queue_timeout", fallback=300)
-
-        delete_searches = config.getboolean("Slskd", "delete_searches", fallback=True)
-
-        slskd_url_base = config.get("Slskd", "url_base", fallback="/")
-
-        ignored_users = config.get("Search Settings", "ignored_users", fallback="").split(",")
-        search_blacklist = config.get("Search Settings", "search_blacklist", fallback="").split(",")
-        search_blacklist = [word.strip() for word in search_blacklist if word.strip()]
-        search_type = config.get("Search Settings", "search_type", fallback="first_page").lower().strip()
-        search_source = config.get("Search Settings", "search_source", fallback="missing").lower().strip()
-
-        download_filtering = config.getboolean("Download Settings", "download_filtering", fallback=False)
-        use_extension_whitelist = config.getboolean("Download Settings", "use_extension_whitelist", fallback=False)
-        extensions_whitelist = config.get("Download Settings", "extensions_whitelist", fallback="txt,nfo,jpg").split(",")
-        rename_download_folders = config.getboolean("Download Settings", "rename_download_folders", fallback=True)
-
-        search_sources = [search_source]
-        if search_sources[0] == "all":
-            search_sources = ["missing", "cutoff_unmet"]
-
-        minimum_match_ratio = config.getfloat("Search Settings", "minimum_filename_match_ratio", fallback=0.5)
-        minimum_search_interval = config.getint("Search Settings", "minimum_search_interval", fallback=5)
-        page_size = config.getint("Search Settings", "number_of_albums_to_grab", fallback=10)
-        failed_import_denylist = config.getboolean("Search Settings", "failed_import_denylist", fallback=True)
-
-        use_selected_lidarr_release = config.getboolean("Release Settings", "use_selected_lidarr_release", fallback=False)
-        use_most_common_tracknum = config.getboolean("Release Settings", "use_most_common_tracknum", fallback=True)
-        allow_multi_disc = config.getboolean("Release Settings", "allow_multi_disc", fallback=True)
-
-        default_accepted_countries = "Europe,Japan,United Kingdom,United States,[Worldwide],Australia,Canada"
-        default_accepted_formats = "CD,Digital Media,Vinyl"
-        accepted_countries = config.get("Release Settings", "accepted_countries", fallback=default_accepted_countries).split(",")
-        skip_region_check = config.getboolean("Release Settings", "skip_region_check", fallback=False)
-        accepted_formats = config.get("Release Settings", "accepted_formats", fallback=default_accepted_formats).split(",")
-
-        raw_filetypes = config.get("Search Settings", "allowed_filetypes", fallback="flac,mp3")
-
-        if "," in raw_filetypes:
-            allowed_filetypes = raw_filetypes.split(",")
+        if args.record and args.replay:
+            logger.error("--record and --replay can't be used together.")
+            sys.exit(1)
+        if args.record:
+            cassette = Cassette(args.record, "record")
+            logger.info(f"Recording slskd and Lidarr traffic to {args.record}")
+        var_dir = args.var_dir
+        if args.replay:
+            cassette = Cassette(args.replay, "replay")
+            clock = ScaledClock(args.replay_speed)
+            # Caches, the failed import list, metrics and the downloads of a replay all live in a fresh
+            # sandbox so replaying into a real var dir changes nothing in it and every replay starts the same
+            var_dir = os.path.join(args.var_dir, "replay")
+            if os.path.exists(var_dir):
+                shutil.rmtree(var_dir)
+            os.makedirs(var_dir)
+            current_page_file_path = os.path.join(var_dir, ".current_page.txt")
+            failed_import_denylist_file_path = os.path.join(var_dir, "failed_imports.json")
+            logger.info(f"Replaying {args.replay} at {args.replay_speed}x speed in {var_dir}. Nothing is sent to slskd or Lidarr")
+
+        if args.daemon and not args.replay:
+            logger.info(f"Starting Soularr in daemon mode. Running every {args.interval} seconds")
+            run_daemon(var_dir, args.interval)
         else:
-            allowed_filetypes = [raw_filetypes]
-
-        # Init directory cache. The wide search returns all the data we need. This prevents us from hammering the users on the Soulseek network
-        search_cache = {}
-        folder_cache = {}
-        broken_user = []
-
-        slskd = slskd_api.SlskdClient(host=slskd_host_url, api_key=slskd_api_key, url_base=slskd_url_base)
-        lidarr = LidarrAPI(lidarr_host_url, lidarr_api_key)
-        wanted_records = []
-        try:
-            for source in search_sources:
-                logging.debug(f"Getting records from {source}")
-                missing = source == "missing"
-                wanted_records.extend(get_records(missing))
-        except ValueError as ex:
-            logger.error(f"An error occurred: {ex}")
-            logger.error("Exiting...")
-            sys.exit(0)
-
-        if len(wanted_records) > 0:
-            try:
-                filtered = filter_list(wanted_records)
-                if filtered is not None:
-                    failed = grab_most_wanted(filtered)
-                else:
-                    failed = 0
-                    logger.info("No releases wanted that aren't on the deny list and/or blacklisted")
-            except Exception:
-                logger.exception("Fatal error! Exiting...")
-
-                if os.path.exists(lock_file_path) and not is_docker():
-                    os.remove(lock_file_path)
+            apply_config(var_dir)
+            if not run_cycle():
+                logger.error("Exiting...")
                 sys.exit(0)
-            if failed == 0:
-                logger.info("Soularr finished. Exiting...")
-                slskd.transfers.remove_completed_downloads()
-            else:
-                logger.info(f"{failed}: releases failed to find a match in the search results and are still wanted.")
-                slskd.transfers.remove_completed_downloads()
-        else:
-            logger.info("No releases wanted. Exiting...")
+            logger.info("Exiting...")
 
     finally:
+        if cassette is not None:
+            cassette.close()
         # Remove the lock file after activity is done
         if os.path.exists(lock_file_path) and not is_docker():
             os.remove(lock_file_path)
@@ -38,6 +38,9 @@ function showView(name, btn) {
     if (name === 'failed-imports') {
         loadFailedImports();
     }
+    if (name === 'traces') {
+        loadTraces();
+    }
     if (mobileQuery.matches) closeSidebar();
 }
 
@@ -222,6 +225,97 @@ function removeFailedImport(albumId) {
         .then(() => loadFailedImports());
 }
 
+const SPAN_COLORS = {
+    search: '#4a7ab0',
+    match: '#8aba8a',
+    browse: '#6a9a6a',
+    enqueue: '#c8b89a',
+    requeue: '#e0a030',
+    download: '#9d7ad2',
+    move: '#7ab0b0',
+    tag: '#b07a9a',
+    lidarr_command: '#d07040',
+};
+
+function formatDuration(seconds) {
+    if (seconds < 60) return seconds.toFixed(1) + 's';
+    if (seconds < 3600) return Math.floor(seconds / 60) + 'm ' + Math.round(seconds % 60) + 's';
+    return Math.floor(seconds / 3600) + 'h ' + Math.round((seconds % 3600) / 60) + 'm';
+}
+
+function escapeHtml(text) {
+    const div = document.createElement('div');
+    div.textContent = text;
+    // Also used inside attributes, so quotes need escaping too
+    return div.innerHTML.replace(/"/g, '&quot;').replace(/'/g, '&#39;');
+}
+
+function spanColor(name) {
+    return Object.prototype.hasOwnProperty.call(SPAN_COLORS, name) ? SPAN_COLORS[name] : '#888';
+}
+
+function traceDetail(album) {
+    const total = album.duration || 1;
+    return album.spans.map(span => {
+        const attrs = Object.entries(span.attrs).map(([key, value]) => `${key}=${value}`).join(' ');
+        const left = Math.min(100, span.offset / total * 100);
+        const width = Math.min(100 - left, span.duration / total * 100);
+        return `
+            <div class="trace-span" title="${escapeHtml(attrs)}">
+                <span class="trace-span-name" style="padding-left:${(span.depth - 1) * 14}px">${escapeHtml(span.name)} <span class="trace-legend">${escapeHtml(attrs)}</span></span>
+                <span class="trace-span-track"><div style="left:${left}%;width:${width}%;background:${spanColor(span.name)}"></div></span>
+                <span class="trace-span-duration">${formatDuration(span.duration)}</span>
+            </div>
+        `;
+    }).join('');
+}
+
+function loadTraces() {
+    fetch('/api/traces')
+        .then(r => r.json())
+        .then(data => {
+            const tbody = document.getElementById('traces-body');
+            const empty = document.getElementById('traces-empty');
+            const count = document.getElementById('traces-count');
+            tbody.innerHTML = '';
+            if (!Array.isArray(data) || data.length === 0) {
+                empty.style.display = 'block';
+                count.textContent = '';
+                return;
+            }
+            empty.style.display = 'none';
+            count.textContent = `${data.length} slowest album${data.length === 1 ? '' : 's'}`;
+            data.forEach(album => {
+                const total = album.duration || 1;
+                const parts = Object.entries(album.breakdown).sort((a, b) => b[1] - a[1]);
+                const bar = parts.map(([name, seconds]) =>
+                    `<div title="${escapeHtml(name)}: ${formatDuration(seconds)}" style="width:${seconds / total * 100}%;background:${spanColor(name)}"></div>`
+                ).join('');
+                const legend = parts.map(([name, seconds]) => `${escapeHtml(name)} ${formatDuration(seconds)}`).join(' · ');
+                const tr = document.createElement('tr');
+                tr.className = 'trace-row';
+                tr.innerHTML = `
+                    <td>${escapeHtml(album.album || '—')}</td>
+                    <td><span class="failed-imports-date">${escapeHtml(album.status || '—')}</span></td>
+                    <td><span class="failed-imports-date">${formatDuration(album.duration)}</span></td>
+                    <td>
+                        <div class="trace-bar">${bar}</div>
+                        <div class="trace-legend">${legend}</div>
+                    </td>
+                `;
+                const detail = document.createElement('tr');
+                detail.className = 'trace-detail';
+                detail.style.display = 'none';
+                detail.innerHTML = `<td colspan="4">${traceDetail(album)}</td>`;
+                tr.onclick = () => {
+                    detail.style.display = detail.style.display === 'none' ? '' : 'none';
+                };
+                tbody.appendChild(tr);
+                tbody.appendChild(detail);
+            });
+        });
+}
+
 const es = new EventSource('/stream');
 es.onmessage = e => appendLine(e.data);
 es.onerror = () => appendLine('--- connection lost, retrying... ---');
@@ -57,6 +57,18 @@ def get_log_path(var_dir):
     log_file = config.get("Logging", "log_file", fallback="soularr.log")
     return os.path.join(var_dir, log_file)
 
+def get_metrics_path(var_dir):
+    config = configparser.ConfigParser()
+    config.read(get_config_path(var_dir))
+    metrics_file = config.get("Metrics", "metrics_file", fallback="soularr_metrics.prom")
+    return os.path.join(var_dir, metrics_file)
+
+def get_trace_path(var_dir):
+    config = configparser.ConfigParser()
+    config.read(get_config_path(var_dir))
+    trace_file = config.get("Metrics", "trace_file", fallback="soularr_trace.jsonl")
+    return os.path.join(var_dir, trace_file)
+
 @app.route("/static/<path:filename>")
 def serve_static(filename):
     return send_from_directory(STATIC_DIR, filename)
@@ -127,6 +139,70 @@ def stream():
         headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
     )
 
+@app.route("/metrics")
+def metrics():
+    path = get_metrics_path(get_var_dir())
+    if not os.path.exists(path):
+        return Response("# No metrics yet. Set enabled = True under [Metrics] in config.ini\n", status=404, mimetype="text/plain")
+    with open(path, "r") as f:
+        content = f.read()
+    return Response(content, mimetype="text/plain; version=0.0.4")
+
+
+@app.route("/api/traces", methods=["GET"])
+def get_traces():
+    path = get_trace_path(get_var_dir())
+    limit = request.args.get("limit", 25, type=int)
+    spans = {}
+    for trace_path in [path + ".1", path]:
+        if not os.path.exists(trace_path):
+            continue
+        with open(trace_path, "r") as f:
+            for line in f:
+                try:
+                    span = json.loads(line)
+                except ValueError:
+                    continue  # Soularr may be writing this line right now
+                spans.setdefault(span["trace"], []).append(span)
+
+    albums = []
+    for trace in spans.values():
+        root = next((span for span in trace if span["parent"] is None), None)
+        if root is None:
+            continue  # Album still in progress
+        parents = {span["id"]: span["parent"] for span in trace}
+        children = []
+        for span in sorted(trace, key=lambda span: span["start"]):
+            if span is root:
+                continue
+            depth, parent = 1, span["parent"]
+            while parents.get(parent) is not None:
+                depth, parent = depth + 1, parents[parent]
+            children.append({
+                "name": span["name"],
+                "offset": round(span["start"] - root["start"], 3),
+                "duration": span["duration"],
+                "depth": depth,
+                "attrs": span.get("attrs", {}),
+            })
+        # Only the top level spans count towards the breakdown, nested ones are already part of their parent
+        breakdown = {}
+        for child in children:
+            if child["depth"] == 1:
+                breakdown[child["name"]] = round(breakdown.get(child["name"], 0) + child["duration"], 3)
+        albums.append({
+            "album_id": root["album_id"],
+            "album": root["album"],
+            "status": root.get("attrs", {}).get("status", ""),
+            "start": root["start"],
+            "duration": root["duration"],
+            "breakdown": breakdown,
+            "spans": children,
+        })
+    albums.sort(key=lambda album: album["duration"], reverse=True)
+    return jsonify(albums[:limit])
+
+
 def get_failed_imports_path(var_dir):
     return os.path.join(var_dir, "failed_imports.json")
 